@@ -1,4 +1,9 @@
 from collections import OrderedDict
+from time import time
+from typing import Dict
+from typing import List
+from typing import Tuple
+from celery import states
 from celery.backends.redis import RedisBackend
 
 
@@ -9,6 +14,35 @@ __all__ = [
 
 
 class RedisDetailBackend(RedisBackend):
+    """
+    Stores the `details` of a `DetailTask` next to the task meta rather
+    than inside of it:
+
+      * `<task key>:details` is a hash of step position to the step's
+        summary (key, description, latest, time, error, done)
+      * `<task key>:details:<position>` is a list of the step's
+        messages, capped at `detail_history_max` entries
+
+    Each write only updates the summaries of the steps that changed and
+    appends the messages that were added since the previous write, so
+    the cost of a write no longer grows with the task's history.
+
+    The same write appends compact step events (`start`, `update`,
+    `end`) to the `<task key>:events` stream, followed by a `finish`
+    event once the task is ready, so that clients can follow a task
+    with `AsyncDetailedResult.iter_events` instead of polling.
+    """
+    #: the number of messages kept for each step
+    detail_history_max = 1000
+    #: the (approximate) number of events kept for each task
+    event_history_max = 10000
+
+    def details_key(self, task_id, position=None) -> bytes:
+        key = self.get_key_for_task(task_id) + b':details'
+        if position is not None:
+            key = b'%s:%d' % (key, position)
+        return key
+
     def _store_result(self, task_id, result, state,
                       traceback=None, request=None, **kwargs):
         """
@@ -24,21 +58,254 @@ class RedisDetailBackend(RedisBackend):
             details = getattr(request, 'details', None)
         else:
             details = kwargs.get('details')
-        if isinstance(details, OrderedDict):
-            details = [ x.to_json() for x in details.values() ]
         meta = {
             'status': state,
             'result': result,
             'traceback': traceback,
             'children': self.current_task_children(request),
-            'details': details,
         }
+        if isinstance(details, OrderedDict):
+            self.ensure(
+                self._store_details, (task_id, list(details.values())))
+            meta['details'] = None
+            meta['detail_count'] = len(details)
+        else:
+            meta['details'] = details
         self.set(self.get_key_for_task(task_id), self.encode(meta))
+        if state in states.READY_STATES:
+            self.ensure(self._add_events, (task_id, [ {
+                'event': 'finish', 'time': time(), 'state': state,
+            } ]))
+        return result
+
+    def _store_details(self, task_id, details):
+        """
+        :type details: List[djenga.celery.tasks.TaskDetail]
+        """
+        written = []
+        events = []
+        summary_key = self.details_key(task_id)
+        # a transaction, so that readers never see a summary without
+        # its messages.  n.b., if the reply to EXEC is lost, `ensure`
+        # retries the write and appends its messages a second time
+        with self.client.pipeline() as pipe:
+            for position, x in enumerate(details):
+                state = x.stored_state()
+                if state != x.stored:
+                    pipe.hset(summary_key, position, self.encode(x.summary()))
+                    self._append_messages(pipe, task_id, position, x)
+                    events.extend(self._step_events(x))
+                    written.append((x, state))
+            if not written:
+                return
+            if self.expires:
+                pipe.expire(summary_key, self.expires)
+            self._add_events(task_id, events, pipe)
+            pipe.execute()
+        for x, state in written:
+            x.stored = state
+            x.n_stored = x.count
+
+    def _append_messages(self, pipe, task_id, position, detail):
+        messages = detail.details_since(detail.n_stored)
+        key = self.details_key(task_id, position)
+        if detail.stored is None:
+            # the first write of this step by this request, so drop
+            # the messages of an earlier run of the same task id
+            # (e.g., after a retry or a redelivery)
+            pipe.delete(key)
+        if not messages:
+            return
+        pipe.rpush(key, *[ self.encode(x) for x in messages ])
+        pipe.ltrim(key, -self.detail_history_max, -1)
+        if self.expires:
+            pipe.expire(key, self.expires)
+
+    def events_key(self, task_id) -> bytes:
+        return self.get_key_for_task(task_id) + b':events'
+
+    @staticmethod
+    def _step_events(detail) -> List[Dict]:
+        """
+        :type detail: djenga.celery.tasks.TaskDetail
+        :return: the events for what changed since the last write,
+                 timed when the changes were made rather than now
+        """
+        events = []
+        now = time()
+        stored = detail.stored
+        was_started = stored is not None and stored[2] is not None
+        if detail.millis is not None and not was_started:
+            events.append({
+                'event': 'start', 'step': detail.key,
+                'time': detail.started_at or now,
+                'message': detail.description,
+            })
+        n = detail.n_stored
+        for x, at in zip(detail.details_since(n), detail.times_since(n)):
+            events.append({
+                'event': 'update', 'step': detail.key, 'time': at or now,
+                'message': x,
+            })
+        if detail.done and not (stored and stored[4]):
+            events.append({
+                'event': 'end', 'step': detail.key,
+                'time': detail.ended_at or now,
+                'message': detail.latest,
+                'error': detail.error,
+            })
+        return events
+
+    def _add_events(self, task_id, events, pipe=None):
+        if not events:
+            return
+        if pipe is None:
+            with self.client.pipeline() as pipe:
+                self._add_events(task_id, events, pipe)
+                pipe.execute()
+            return
+        key = self.events_key(task_id)
+        for x in events:
+            pipe.xadd(
+                key, { 'e': self.encode(x) },
+                maxlen=self.event_history_max, approximate=True)
+        if self.expires:
+            pipe.expire(key, self.expires)
+
+    def read_events(self, task_id, last_id='0',
+                    block=None, count=None) -> List[Tuple[str, Dict]]:
+        """
+        :param last_id: only return events after this id, `'0'` for all
+        :param block: the number of milliseconds to wait for new events
+        :param count: the maximum number of events to return
+        :return: a list of (event id, event dict)
+        """
+        key = self.events_key(task_id)
+        response = self.client.xread({ key: last_id }, count, block)
+        result = []
+        for _, values in response or []:
+            for event_id, fields in values:
+                if isinstance(event_id, bytes):
+                    event_id = event_id.decode()
+                result.append((event_id, self.decode(fields[b'e'])))
+        return result
+
+    def get_details(self, task_id, n_steps: int) -> List[Dict]:
+        """
+        reads the details written by `_store_details` with a single
+        pipelined round-trip and rebuilds the list of
+        `TaskDetail.to_json()` dicts
+        """
+        with self.client.pipeline(transaction=False) as pipe:
+            self._queue_details(pipe, task_id, n_steps)
+            values = pipe.execute()
+        return self._build_details(n_steps, values)
+
+    def get_many_details(self, task_ids) -> Dict[str, List[Dict]]:
+        """
+        :return: a dict of task id to the list of detail dicts, which is
+                 empty for tasks without a result, see `get_many_metas`
+        """
+        metas = self.get_many_metas(task_ids)
+        return { key: x['details'] for key, x in metas.items() }
+
+    def get_many_metas(self, task_ids) -> Dict[str, Dict]:
+        """
+        reads the metas of many tasks with one `MGET` and, for tasks
+        using delta storage, the details of all of their steps with one
+        more pipelined round-trip
+        :return: a dict of task id to its meta, with the list of detail
+                 dicts in `details`; tasks without a result are `PENDING`
+        """
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+        keys = [ self.get_key_for_task(x) for x in task_ids ]
+        result = {}
+        deltas = []
+        for task_id, value in zip(task_ids, self.mget(keys)):
+            meta = self._decode_meta(value)
+            n_steps = meta.get('detail_count')
+            if meta.get('details') is None and n_steps is not None:
+                deltas.append((task_id, n_steps))
+            meta['details'] = meta.get('details') or []
+            result[task_id] = meta
+        if deltas:
+            for task_id, details in self._get_delta_details(deltas).items():
+                result[task_id]['details'] = details
+        return result
+
+    def _decode_meta(self, value):
+        if not value:
+            return { 'status': states.PENDING, 'result': None }
+        return self.decode_result(value)
+
+    def _get_delta_details(self, deltas) -> Dict[str, List[Dict]]:
+        """
+        :param deltas: a list of (task id, number of steps)
+        """
+        with self.client.pipeline(transaction=False) as pipe:
+            for task_id, n_steps in deltas:
+                self._queue_details(pipe, task_id, n_steps)
+            values = pipe.execute()
+        result = {}
+        offset = 0
+        for task_id, n_steps in deltas:
+            result[task_id] = self._build_details(
+                n_steps, values[offset:offset + n_steps + 1])
+            offset += n_steps + 1
         return result
 
+    def _queue_details(self, pipe, task_id, n_steps):
+        pipe.hgetall(self.details_key(task_id))
+        for position in range(n_steps):
+            pipe.lrange(self.details_key(task_id, position), 0, -1)
+
+    def _build_details(self, n_steps, values) -> List[Dict]:
+        summaries, *messages = values
+        details = []
+        for position in range(n_steps):
+            summary = summaries.get(b'%d' % position)
+            if summary is None:
+                continue
+            value = self.decode(summary)
+            value['details'] = [ self.decode(x) for x in messages[position] ]
+            details.append(value)
+        return details
+
+    def progress_key(self, task_id) -> bytes:
+        return self.get_key_for_task(task_id) + b':progress'
+
+    def append_progress(self, task_id, *messages):
+        """
+        appends to the full progress history of a task,
+        see `djenga.celery.utils.update_progress`
+        """
+        key = self.progress_key(task_id)
+        with self.client.pipeline() as pipe:
+            pipe.rpush(key, *[ self.encode(x) for x in messages ])
+            if self.expires:
+                pipe.expire(key, self.expires)
+            pipe.execute()
+
+    def get_progress(self, task_id, start=0, stop=-1) -> List[str]:
+        """
+        :return: the progress messages from `start` through `stop`
+                 (inclusive, negative values count from the end)
+        """
+        values = self.client.lrange(self.progress_key(task_id), start, stop)
+        return [ self.decode(x) for x in values ]
+
+    def _forget(self, task_id):
+        super()._forget(task_id)
+        summary_key = self.details_key(task_id)
+        positions = self.client.hkeys(summary_key)
+        keys = [ b'%s:%s' % (summary_key, x) for x in positions ]
+        self.client.delete(
+            summary_key, self.progress_key(task_id),
+            self.events_key(task_id), *keys)
+
 
 def patch_aliases():
     from celery.app.backends import BACKEND_ALIASES
     BACKEND_ALIASES['redisd'] = 'djenga.celery.backends.RedisDetailBackend'
-
-
@@ -0,0 +1,153 @@
+import logging
+import os
+from threading import Condition
+from threading import Thread
+from time import monotonic
+from typing import Dict
+
+
+__all__ = [
+    'DetailFlusher',
+    'FlushState',
+    'detail_flush_stats',
+]
+logger = logging.getLogger(__name__)
+
+
+class FlushState:
+    """
+    The flush bookkeeping of one task request.  It is shared, rather
+    than copied, by the copies of the request that `bind_detail`
+    pushes in other threads, so that all of their updates count
+    against the same `details_min_interval`.
+    """
+    __slots__ = ('last_flush', 'pending')
+
+    def __init__(self):
+        #: the `monotonic` time of the last write
+        self.last_flush = 0.0
+        #: the number of updates since then
+        self.pending = 0
+
+
+class _PendingWrite:
+    __slots__ = ('task', 'request', 'due')
+
+    def __init__(self, task, request, due):
+        self.task = task
+        self.request = request
+        self.due = due
+
+
+class DetailFlusher:
+    """
+    Writes `DetailTask` details to the result backend from a single
+    background thread per process.  While a write for a task is
+    pending, further updates for that task are folded into it, so a
+    task that reports progress in a tight loop only writes its latest
+    state once per `DetailTask.details_min_interval`.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.condition = Condition()
+        self.pending: Dict[str, _PendingWrite] = {}
+        self.writing = set()
+        self.thread = None
+        self.writes = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def schedule(self, task, request, due):
+        """
+        :type task: djenga.celery.tasks.DetailTask
+        :param request: the task request holding the `details`
+        :param due: the `monotonic` time by which to write
+        """
+        with self.condition:
+            if self.thread is None:
+                self.thread = Thread(
+                    target=self.run, name='djenga-detail-flusher',
+                    daemon=True)
+                self.thread.start()
+            entry = self.pending.get(request.id)
+            if entry:
+                self.coalesced += 1
+                entry.due = min(entry.due, due)
+            else:
+                self.pending[request.id] = _PendingWrite(task, request, due)
+            self.condition.notify()
+
+    def discard(self, task_id):
+        """
+        drops the pending write for `task_id`, if any, and waits for an
+        in-flight write to finish so that it cannot land on top of the
+        final state of the task
+        """
+        with self.condition:
+            if self.pending.pop(task_id, None):
+                self.coalesced += 1
+            while task_id in self.writing:
+                self.condition.wait()
+
+    def next_due(self) -> _PendingWrite:
+        while True:
+            if not self.pending:
+                self.condition.wait()
+                continue
+            entry = min(self.pending.values(), key=lambda x: x.due)
+            delay = entry.due - monotonic()
+            if delay <= 0:
+                del self.pending[entry.request.id]
+                return entry
+            self.condition.wait(delay)
+
+    def run(self):
+        while True:
+            with self.condition:
+                entry = self.next_due()
+                self.writing.add(entry.request.id)
+            request = entry.request
+            try:
+                with request.details_lock:
+                    entry.task.store_details(request.id, request.details)
+                    request.details_flush.last_flush = monotonic()
+                    request.details_flush.pending = 0
+                written = True
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.warning('[djenga]  dropped detail write: %s', ex)
+                written = False
+            with self.condition:
+                if written:
+                    self.writes += 1
+                else:
+                    self.dropped += 1
+                self.writing.discard(request.id)
+                self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'writes': self.writes,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'pending': len(self.pending),
+            }
+
+
+flusher = DetailFlusher()
+# a forked worker must not inherit the flusher thread's
+# (non-existent) state or a lock held by it at fork time
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=flusher.reset)
+
+
+def detail_flush_stats():
+    """
+    :return: a dict with the number of background detail `writes`,
+             the number of updates that were `coalesced` into another
+             write, the number of writes `dropped` because the backend
+             failed, and the number of `pending` writes
+    """
+    return flusher.stats()
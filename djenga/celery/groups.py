@@ -0,0 +1,205 @@
+from collections import namedtuple
+import logging
+from time import time
+from typing import Dict
+from celery import states
+from celery.result import AsyncResult
+from .results import AsyncDetailedResult
+
+
+__all__ = [
+    'DetailGroup',
+    'GroupProgress',
+]
+logger = logging.getLogger(__name__)
+GroupProgress = namedtuple(
+    'GroupProgress',
+    'total dispatched succeeded failed running fraction eta')
+
+
+def _fraction(details):
+    """
+    :return: the fraction of the steps of a running task that are done
+    """
+    if not details:
+        return 0.0
+    return sum(1 for x in details if x.get('done')) / len(details)
+
+
+class DetailGroup:
+    """
+    Dispatches child tasks from a parent `DetailTask` in batches, with
+    at most `max_in_flight` children running at a time, and rolls their
+    progress up into the parent's current step.
+
+    Each call to `poll` reads the metas and details of all running
+    children at once (one `MGET` plus one pipelined read with the
+    `RedisDetailBackend`), dispatches more children as slots free up,
+    and adds a "n/m children done, ETA" message to the parent.  Rather
+    than sleeping between polls, the parent can hand its worker slot
+    back with `retry`, which re-runs the parent later with the group's
+    `state` in its `group_state` kwarg:
+
+        @app.task(bind=True, base=DetailTask)
+        def steal_all_moons(self, moon_ids, group_state=None):
+            self.start_step(1, 'steal the moons')
+            group = DetailGroup(
+                self, [ steal_the_moon.s(x) for x in moon_ids ],
+                max_in_flight=10, state=group_state)
+            group.poll()
+            if not group.done:
+                group.retry(countdown=5)
+            self.end_step()
+            return group.task_ids
+    """
+    def __init__(self, task, signatures, max_in_flight=10,
+                 batch_size=None, state=None):
+        """
+        :type task: djenga.celery.tasks.DetailTask
+        :param signatures: the `Signature`s of the child tasks, in the
+                           same order on every run of the parent
+        :param max_in_flight: the maximum number of running children
+        :param batch_size: the maximum number of children to dispatch
+                           per poll, defaults to `max_in_flight`
+        :param state: the `state()` of the group from a previous run
+        """
+        self.task = task
+        self.signatures = list(signatures)
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size or max_in_flight
+        state = state or {}
+        self.task_ids = list(state.get('task_ids', []))
+        self.finished: Dict[str, str] = dict(state.get('finished', {}))
+        self.started = state.get('started') or time()
+        self.cancelled = state.get('cancelled', False)
+
+    def state(self) -> Dict:
+        """
+        :return: a json-serializable dict to resume the group from
+        """
+        return {
+            'task_ids': self.task_ids,
+            'finished': self.finished,
+            'started': self.started,
+            'cancelled': self.cancelled,
+        }
+
+    @property
+    def running(self):
+        return [ x for x in self.task_ids if x not in self.finished ]
+
+    @property
+    def done(self) -> bool:
+        if self.running:
+            return False
+        return self.cancelled or len(self.task_ids) == len(self.signatures)
+
+    def dispatch(self):
+        """
+        dispatches the next batch of children, if there is room
+        """
+        n_running = len(self.running)
+        start = len(self.task_ids)
+        n = min(self.batch_size, self.max_in_flight - n_running)
+        for x in self.signatures[start:start + max(n, 0)]:
+            self.task_ids.append(x.apply_async().id)
+
+    def read(self, task_ids) -> Dict[str, Dict]:
+        """
+        :return: a dict of task id to its meta, including its `details`
+        """
+        backend = self.task.backend
+        get_many_metas = getattr(backend, 'get_many_metas', None)
+        if get_many_metas:
+            return get_many_metas(task_ids)
+        return {
+            x: {
+                'status': AsyncResult(x, backend=backend).state,
+                'details': AsyncDetailedResult(
+                    x, backend=backend).details() or [],
+            }
+            for x in task_ids
+        }
+
+    def poll(self) -> GroupProgress:
+        """
+        checks on the running children without blocking, dispatches
+        more of them and reports the progress of the group
+        """
+        partial = 0.0
+        for task_id, meta in self.read(self.running).items():
+            status = meta.get('status')
+            if status in states.READY_STATES:
+                self.finished[task_id] = status
+            else:
+                partial += _fraction(meta.get('details'))
+        if not self.cancelled:
+            self.dispatch()
+        progress = self.progress(partial)
+        self.report(progress)
+        return progress
+
+    def progress(self, partial=0.0) -> GroupProgress:
+        """
+        :param partial: the sum of the fractions of the
+                        running children that are done
+        """
+        total = len(self.signatures)
+        succeeded = sum(
+            1 for x in self.finished.values() if x == states.SUCCESS)
+        n_finished = len(self.finished)
+        fraction = (n_finished + partial) / total if total else 1.0
+        eta = None
+        if 0 < fraction < 1:
+            eta = (time() - self.started) * (1 - fraction) / fraction
+        return GroupProgress(
+            total, len(self.task_ids), succeeded, n_finished - succeeded,
+            len(self.task_ids) - n_finished, fraction, eta)
+
+    def report(self, progress: GroupProgress):
+        if getattr(self.task.request, 'current_detail', None) is None:
+            return
+        message = '%d/%d children done' % (
+            progress.succeeded + progress.failed, progress.total)
+        if progress.failed:
+            message += ', %d failed' % (progress.failed,)
+        if progress.eta is not None:
+            message += ', ETA %ds' % (round(progress.eta),)
+        self.task.update_step(message)
+
+    def cancel(self, terminate=False):
+        """
+        revokes the children that are still running
+        and stops dispatching new ones
+        """
+        self.cancelled = True
+        running = self.running
+        if running:
+            self.task.app.control.revoke(running, terminate=terminate)
+        for x in running:
+            self.finished[x] = states.REVOKED
+
+    def retry(self, countdown=5, max_polls=None):
+        """
+        re-runs the parent task in `countdown` seconds with the
+        `state` of the group as its `group_state` kwarg, freeing
+        the worker in the meantime.  the step that is running is
+        resumed, rather than started again, when the next run starts
+        the step with the same key.  this raises
+        `celery.exceptions.Retry`.
+        :param max_polls: the maximum number of times to retry,
+                          None for no limit
+        """
+        kwargs = dict(self.task.request.kwargs or {})
+        kwargs['group_state'] = dict(
+            self.state(), step=self.task.step_state())
+        raise self.task.retry(
+            kwargs=kwargs, countdown=countdown,
+            max_retries=float('inf') if max_polls is None else max_polls)
+
+    def results(self):
+        """
+        :return: the `AsyncResult`s of the children that were dispatched
+        """
+        backend = self.task.backend
+        return [ AsyncResult(x, backend=backend) for x in self.task_ids ]
@@ -1,10 +1,46 @@
+import asyncio
+from functools import partial
+from threading import Lock
+from time import monotonic
 from typing import List, Dict
+from celery import current_app
 from celery.result import AsyncResult
+from celery.result import ResultSet
 
 
 __all__ = [
     'AsyncDetailedResult',
+    'DetailedResultSet',
+    'clear_details_cache',
 ]
+#: task id -> (expiry, details) for `details_many(..., cache_ttl=...)`
+_details_cache = {}
+_details_lock = Lock()
+
+
+def clear_details_cache():
+    with _details_lock:
+        _details_cache.clear()
+
+
+def _cached_details(task_ids, now):
+    with _details_lock:
+        result = {}
+        for x in task_ids:
+            entry = _details_cache.get(x)
+            if entry and entry[0] > now:
+                result[x] = entry[1]
+        return result
+
+
+def _cache_details(values, expires, now):
+    with _details_lock:
+        if len(_details_cache) > 2 * len(values):
+            stale = [ k for k, v in _details_cache.items() if v[0] <= now ]
+            for x in stale:
+                del _details_cache[x]
+        for key, value in values.items():
+            _details_cache[key] = (expires, value)
 
 
 class AsyncDetailedResult(AsyncResult):
@@ -26,4 +62,158 @@ class AsyncDetailedResult(AsyncResult):
         :return:
         """
         meta = self._get_task_meta()
-        return meta.get('details') if meta else []
+        if not meta:
+            return []
+        details = meta.get('details')
+        n_steps = meta.get('detail_count')
+        if details is None and n_steps is not None:
+            return self.backend.get_details(self.id, n_steps)
+        return details
+
+    @classmethod
+    def details_many(cls, task_ids, backend=None, app=None,
+                     cache_ttl=0) -> Dict[str, List[Dict]]:
+        """
+        Returns the `details()` of many tasks at once.  With a
+        `RedisDetailBackend`, the task metas are read with a single
+        `MGET` instead of one round-trip per task.
+        :param task_ids: the ids of the tasks
+        :param backend: the result backend, defaults to the app's
+        :param app: the celery app, defaults to the current app
+        :param cache_ttl: the number of seconds for which the details
+                          may be served from an in-process cache,
+                          e.g., to share them across one page render
+        :return: a dict of task id to its details
+        """
+        task_ids = list(dict.fromkeys(task_ids))
+        backend = backend or (app or current_app).backend
+        now = monotonic()
+        result = _cached_details(task_ids, now) if cache_ttl else {}
+        missing = [ x for x in task_ids if x not in result ]
+        if missing:
+            get_many_details = getattr(backend, 'get_many_details', None)
+            if get_many_details:
+                fetched = get_many_details(missing)
+            else:
+                fetched = {
+                    x: cls(x, backend=backend, app=app).details() or []
+                    for x in missing
+                }
+            if cache_ttl:
+                _cache_details(fetched, now + cache_ttl, now)
+            result.update(fetched)
+        return { x: result[x] for x in task_ids }
+
+    def _read_events(self):
+        read_events = getattr(self.backend, 'read_events', None)
+        if read_events is None:
+            raise NotImplementedError(
+                'Step events require the RedisDetailBackend')
+        return partial(read_events, self.id)
+
+    @staticmethod
+    def _wait(block, deadline):
+        """
+        :return: the number of milliseconds to block for
+                 or None when the deadline has passed
+        """
+        if deadline is None:
+            return int(1000 * block)
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return None
+        return max(1, int(1000 * min(block, remaining)))
+
+    def iter_events(self, last_id='0', timeout=None, block=1.0):
+        """
+        Yields the step events of the task as they are published by the
+        `RedisDetailBackend`, i.e., dicts with the `event` (`start`,
+        `update`, `end` or `finish`), the `step` key, the `time` and the
+        `message`, plus the event's `id`.  Stops after the `finish`
+        event or once `timeout` seconds have passed.
+        :param last_id: only yield events after this id, `'0'` for all
+        :param timeout: the maximum number of seconds to wait, or None
+        :param block: the number of seconds to wait per redis call
+        """
+        read_events = self._read_events()
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            wait = self._wait(block, deadline)
+            if wait is None:
+                return
+            for last_id, event in read_events(last_id, wait):
+                event['id'] = last_id
+                yield event
+                if event['event'] == 'finish':
+                    return
+
+    async def aiter_events(self, last_id='0', timeout=None, block=1.0):
+        """
+        The asyncio version of `iter_events`; the blocking reads run in
+        the event loop's default executor.
+        """
+        read_events = self._read_events()
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            wait = self._wait(block, deadline)
+            if wait is None:
+                return
+            events = await loop.run_in_executor(
+                None, read_events, last_id, wait)
+            for last_id, event in events:
+                event['id'] = last_id
+                yield event
+                if event['event'] == 'finish':
+                    return
+
+    def progress(self, start=0, count=None) -> List[str]:
+        """
+        Pages through the full progress history written by
+        `djenga.celery.utils.update_progress`.  Backends that do not
+        keep the full history only return the recent messages.
+        :param start: the index of the first message to return
+        :param count: the maximum number of messages, None for all
+        """
+        get_progress = getattr(self.backend, 'get_progress', None)
+        if get_progress:
+            stop = -1 if count is None else start + count - 1
+            return get_progress(self.id, start, stop)
+        meta = self._get_task_meta()
+        result = meta.get('result') if meta else None
+        if not isinstance(result, dict) or not result.get('progress'):
+            return []
+        messages = result['progress'].split('\n')
+        stop = None if count is None else start + count
+        return messages[start:stop]
+
+
+class DetailedResultSet(ResultSet):
+    """
+    A `ResultSet` of `AsyncDetailedResult`s that polls the details of
+    all of its tasks at once, see `AsyncDetailedResult.details_many`.
+    """
+    def __init__(self, results, app=None, backend=None, cache_ttl=0,
+                 **kwargs):
+        """
+        :param results: task ids or `AsyncResult`s
+        :param cache_ttl: see `AsyncDetailedResult.details_many`
+        """
+        self._backend = backend
+        results = [
+            x if isinstance(x, AsyncDetailedResult)
+            else AsyncDetailedResult(getattr(x, 'id', x),
+                                     backend=backend, app=app)
+            for x in results
+        ]
+        super().__init__(results, app=app, **kwargs)
+        self.cache_ttl = cache_ttl
+
+    @property
+    def backend(self):
+        return self._backend or super().backend
+
+    def details(self) -> Dict[str, List[Dict]]:
+        return AsyncDetailedResult.details_many(
+            [ x.id for x in self.results ],
+            backend=self.backend, app=self.app, cache_ttl=self.cache_ttl)
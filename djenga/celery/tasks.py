@@ -1,9 +1,24 @@
 from abc import abstractmethod
+from collections import deque
 from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from functools import wraps
+from itertools import islice
 import logging
+import os
+from threading import RLock
+from time import monotonic
+from time import perf_counter_ns
 from time import time
 from celery.app.task import Task
 from celery import states
+from ..utils.list_utils import chunkify_iterable
+from .flusher import FlushState
+from .flusher import flusher
+from .timings import record_step
 
 
 __all__ = [
@@ -11,9 +26,30 @@ __all__ = [
     'TaskDetail',
 ]
 logger = logging.getLogger(__name__)
+_EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
 
 
 class TaskDetail:
+    """
+    The state of one step of a `DetailTask`.  Only the last
+    `max_details` messages are kept in memory; `count` is the number
+    of messages that were ever added.  While a step runs, `millis` is
+    the wall-clock time at which it started; once it ends, `millis` is
+    its duration, measured with `perf_counter_ns`.  `started_at`,
+    `ended_at` and `added_at` hold the wall-clock times at which the
+    step started, ended and had each of its kept messages added.
+    """
+    __slots__ = (
+        'key', 'description', 'detail', 'count', 'millis', 'done',
+        'error', 'started_ns', 'started_at', 'ended_at', 'added_at',
+        'n_stored', 'stored', '_json', '_json_state',
+    )
+    #: the number of messages kept for each step
+    max_details = 1000
+
     def __init__(  # pylint: disable=W1113
             self, key=None, description=None,
             *args, **kwargs):
@@ -23,38 +59,214 @@ class TaskDetail:
         """
         self.key = key
         self.description = description
-        self.detail = []
+        self.detail = deque(maxlen=self.max_details)
+        self.count = 0
         self.millis = None
         self.done = False
         self.error = False
+        self.started_ns = None
+        self.started_at = None
+        self.ended_at = None
+        self.added_at = deque(maxlen=self.max_details)
+        # what the backend has already written, see RedisDetailBackend
+        self.n_stored = 0
+        self.stored = None
+        self._json = None
+        self._json_state = None
 
     def add_detail(self, detail):
         self.detail.append(detail)
+        self.added_at.append(time())
+        self.count += 1
+
+    def details_since(self, n):
+        """
+        :param n: a previous value of `count`
+        :return: the messages added since then that are still kept
+        """
+        n_new = min(self.count - n, len(self.detail))
+        if n_new <= 0:
+            return []
+        return list(islice(self.detail, len(self.detail) - n_new, None))
+
+    def times_since(self, n):
+        """
+        :return: the times at which the `details_since(n)` were added
+        """
+        n_new = min(self.count - n, len(self.added_at))
+        if n_new <= 0:
+            return []
+        return list(islice(self.added_at, len(self.added_at) - n_new, None))
+
+    @property
+    def latest(self):
+        return self.detail[-1] if self.detail else None
+
+    def stored_state(self):
+        return (
+            self.count, self.description,
+            self.millis, self.error, self.done,
+        )
 
     def start_time(self):
-        self.millis = time()
+        self.millis = self.started_at = time()
+        self.started_ns = perf_counter_ns()
+
+    def resume(self, started_at, count, latest=None):
+        """
+        picks up where the same step of a previous run of the task
+        left off (see `DetailTask.step_state`), without starting it
+        again: its start time, and hence its duration, carry over,
+        and what that run already stored is not stored again
+        """
+        self.millis = self.started_at = started_at
+        elapsed = max(time() - started_at, 0)
+        self.started_ns = perf_counter_ns() - int(elapsed * 1e9)
+        if latest is not None:
+            self.detail.append(latest)
+            self.added_at.append(None)
+        self.count = self.n_stored = count
+        self.stored = self.stored_state()
 
     def end_time(self):
         self.done = True
-        self.millis = int(1000 * (time() - (self.millis or 0)))
+        self.ended_at = time()
+        if self.started_ns is None:
+            self.millis = 0
+        else:
+            self.millis = (perf_counter_ns() - self.started_ns) // 1000000
 
-    def to_json(self):
+    def summary(self):
+        """
+        :return: the `to_json` dict without the list of details
+        """
         return {
             'key': self.key,
             'description': self.description,
-            'details': self.detail,
-            'latest': self.detail[-1] if self.detail else None,
+            'latest': self.latest,
             'time': self.millis,
             'error': self.error,
             'done': self.done,
         }
 
+    def to_json(self):
+        """
+        :return: a dict that is cached until the step changes,
+                 so it must not be modified
+        """
+        state = self.stored_state()
+        if self._json is None or self._json_state != state:
+            data = self.summary()
+            data['details'] = list(self.detail)
+            self._json = data
+            self._json_state = state
+        return self._json
+
+    def __getstate__(self):
+        return {
+            x: getattr(self, x) for x in TaskDetail.__slots__
+            if not x.startswith('_json')
+        }
+
+    def __setstate__(self, state):
+        self._json = self._json_state = None
+        # the defaults for state pickled before these were kept
+        self.started_at = self.ended_at = None
+        self.added_at = deque(
+            [ None ] * len(state.get('detail', ())),
+            maxlen=self.max_details)
+        for key, value in state.items():
+            setattr(self, key, value)
+
     def __str__(self):
         return '%s: %s' % (self.key, self.description,)
 
 
+def _submit(pool, fn, chunks, pending, n_max):
+    """
+    :return: False once `chunks` is exhausted
+    """
+    while len(pending) < n_max:
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        pending.append(pool.submit(fn, chunk))
+    return True
+
+
+def _bounded_map(pool, fn, chunks, n_max, ordered):
+    """
+    yields `fn(chunk)` for each chunk, with at most `n_max` chunks
+    submitted to `pool` at a time, in order or as they complete
+    """
+    pending = deque()
+    chunks = iter(chunks)
+    more = True
+    try:
+        while True:
+            more = more and _submit(pool, fn, chunks, pending, n_max)
+            if not pending:
+                return
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = done.pop()
+                pending.remove(future)
+            yield future.result()
+    finally:
+        for x in pending:
+            x.cancel()
+
+
+class _ChunkProgress:
+    """
+    adds "n/m chunks, ETA" messages for `DetailTask.parallel_map`
+    to the current step, at most once every `interval` seconds
+    """
+    def __init__(self, task, n_chunks, interval):
+        self.task = task
+        self.n_chunks = n_chunks
+        self.interval = interval
+        self.n_done = self.n_reported = 0
+        self.started = self.reported = monotonic()
+
+    def update(self):
+        self.n_done += 1
+        if monotonic() - self.reported >= self.interval:
+            self.report()
+
+    def report(self):
+        if self.n_reported == self.n_done and self.n_done:
+            return
+        self.n_reported = self.n_done
+        self.reported = now = monotonic()
+        if getattr(self.task.request, 'current_detail', None) is None:
+            return
+        n_done, n_chunks = self.n_done, self.n_chunks
+        if n_chunks is None:
+            self.task.update_step('%d chunks', n_done)
+        elif n_done >= n_chunks or not n_done:
+            self.task.update_step('%d/%d chunks', n_done, n_chunks)
+        else:
+            eta = (now - self.started) / n_done * (n_chunks - n_done)
+            self.task.update_step(
+                '%d/%d chunks, ETA %ds', n_done, n_chunks, round(eta))
+
+
 class DetailTask(Task):
     steps = None
+    #: the minimum number of seconds between two detail writes for
+    #: the same task.  0 writes every update right away; anything else
+    #: hands writes to a background thread that coalesces them.
+    details_min_interval = 0
+    #: write as soon as this many updates are pending (0 for no limit)
+    details_max_pending = 0
+    #: write as soon as a step ends, regardless of the interval
+    details_flush_on_end_step = True
+    #: the kwarg whose `step` holds the `step_state` of a previous run,
+    #: which `DetailGroup.retry` passes to the next run of the task
+    resume_kwarg = 'group_state'
 
     def __init__(self, steps=None):
         super().__init__()
@@ -63,6 +275,33 @@ class DetailTask(Task):
         for key, description in self.steps:
             self.details[key] = description
 
+    def after_return(  # pylint: disable=too-many-arguments
+            self, status, retval, task_id, args, kwargs, einfo):
+        super().after_return(status, retval, task_id, args, kwargs, einfo)
+        if not task_id or not self.details_min_interval:
+            return
+        flusher.discard(task_id)
+        r = self.request
+        flushed = getattr(r, 'details_flush', None)
+        if not flushed or not flushed.last_flush or not self.stores_result():
+            return
+        # celery wrote the final state before calling us, so a write
+        # from the flusher may have landed on top of it
+        self.backend.store_result(
+            task_id, retval, status,
+            traceback=einfo.traceback if einfo else None, request=r)
+
+    def stores_result(self):
+        r = self.request
+        if r.is_eager and not self.app.conf.task_store_eager_result:
+            return False
+        # Context has a class-level default, so only an explicit
+        # ignore_result on the request overrides the task's
+        ignore_result = vars(r).get('ignore_result')
+        if ignore_result is None:
+            ignore_result = self.ignore_result
+        return not ignore_result
+
     def initialize_detail(self):
         if not hasattr(self.request, 'details'):
             self.request.details = OrderedDict([
@@ -71,26 +310,160 @@ class DetailTask(Task):
             ])
             self.request.detail_stack = list()
             self.request.current_detail = None
+            # the step that `bind_detail` inherited from another thread
+            self.request.detail_base = None
+            self.request.details_lock = RLock()
+            self.request.details_flush = FlushState()
+            resumed = (self.request.kwargs or {}).get(self.resume_kwarg)
+            self.request.resumed_step = (
+                resumed.get('step') if isinstance(resumed, dict) else None)
+
+    def store_details(self, task_id, details):
+        self.backend.store_result(
+            task_id,
+            result=None,
+            state=states.STARTED,
+            details=details)
+
+    def save_details(self, force=False):
+        """
+        :param force: write without waiting for `details_min_interval`
+        """
+        r = self.request
+        if not r.id:
+            return
+        if not self.details_min_interval:
+            with r.details_lock:
+                self.store_details(r.id, r.details)
+            return
+        with r.details_lock:
+            state = r.details_flush
+            state.pending += 1
+            due = state.last_flush + self.details_min_interval
+            n_max = self.details_max_pending
+            if force or (n_max and state.pending >= n_max):
+                due = monotonic()
+        flusher.schedule(self, r, due)
+
+    def bind_detail(self, fn):
+        """
+        Celery requests are thread-local, so calling `update_step` or
+        `start_step` from another thread, e.g., from a thread pool
+        within the task, would not find the task's details.  The
+        callable returned here runs `fn` with a copy of the current
+        request that shares its details, but has its own stack of
+        steps; `update_step` adds to the current step of the calling
+        thread until the worker thread starts a step of its own.
+
+            with ThreadPoolExecutor() as pool:
+                pool.map(self.bind_detail(fetch), urls)
+        """
+        self.initialize_detail()
+        values = dict(self.request.__dict__)
+        current = values['current_detail']
+        values.update(current_detail=current, detail_base=current)
+
+        @wraps(fn)
+        def bound(*args, **kwargs):
+            self.push_request(**dict(values, detail_stack=[]))
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.pop_request()
+        return bound
+
+    def parallel_map(  # pylint: disable=too-many-arguments
+            self, fn, iterable, chunk_size=1000, workers=None,
+            executor='thread', ordered=True, progress_interval=1.0):
+        """
+        Splits `iterable` into chunks with `chunkify_iterable`, calls
+        `fn(chunk)` for each chunk on a pool of `workers`, and yields
+        the results.  While it runs, "n/m chunks, ETA" messages are
+        added to the current step at most once every
+        `progress_interval` seconds.
 
-    def save_details(self):
-        if self.request.id:
-            self.backend.store_result(
-                self.request.id,
-                result=None,
-                state=states.STARTED,
-                details=self.request.details)
+            self.start_step(1, 'resize images')
+            for sizes in self.parallel_map(resize, ids, chunk_size=50):
+                ...
+            self.end_step()
+
+        :param fn: called with a list of values; with the `process`
+                   executor, it must be picklable
+        :param iterable: the values; `m` is only known (and an ETA only
+                         given) when it has a `len`
+        :param chunk_size: the maximum number of values per chunk
+        :param workers: the size of the pool, defaults to the cpu count
+        :param executor: `thread` for i/o-bound work or `process` for
+                         cpu-bound work
+        :param ordered: False to yield results as chunks complete
+        :param progress_interval: the minimum number of seconds between
+                                  progress messages
+        """
+        # checked here, rather than in the generator,
+        # so that bad arguments fail at the call
+        if chunk_size < 1:
+            raise ValueError(f'Unsupported chunk size {chunk_size}')
+        if executor not in _EXECUTORS:
+            raise ValueError(f'Unsupported executor {executor}')
+        return self._parallel_map(
+            fn, iterable, chunk_size, workers, executor, ordered,
+            progress_interval)
+
+    def _parallel_map(  # pylint: disable=too-many-arguments
+            self, fn, iterable, chunk_size, workers,
+            executor, ordered, progress_interval):
+        n_chunks = None
+        if hasattr(iterable, '__len__'):
+            n_chunks = -(-len(iterable) // chunk_size)
+        progress = _ChunkProgress(self, n_chunks, progress_interval)
+        workers = workers or os.cpu_count() or 1
+        chunks = chunkify_iterable(iterable, chunk_size)
+        with _EXECUTORS[executor](workers) as pool:
+            results = _bounded_map(pool, fn, chunks, 2 * workers, ordered)
+            try:
+                for result in results:
+                    progress.update()
+                    yield result
+            finally:
+                results.close()
+        progress.report()
+
+    def step_state(self):
+        """
+        :return: a json-serializable dict from which the next run of the
+                 task (e.g., a retry) can resume the running step, or
+                 None when no step is running
+        """
+        current = getattr(self.request, 'current_detail', None)
+        if current is None or current.done or current.started_at is None:
+            return None
+        return {
+            'key': current.key,
+            'started_at': current.started_at,
+            'count': current.count,
+            'latest': current.latest,
+        }
 
     def start_step(self, key, description=None, detail='in progress'):
         self.initialize_detail()
         r = self.request
-        if key not in r.details:
-            r.current_detail = r.details.setdefault(
-                key, TaskDetail(key, description))
-        else:
-            r.current_detail = r.details[key]
-        r.current_detail.start_time()
-        r.current_detail.add_detail(detail)
-        r.detail_stack.append(r.current_detail)
+        with r.details_lock:
+            if key not in r.details:
+                r.current_detail = r.details.setdefault(
+                    key, TaskDetail(key, description))
+            else:
+                r.current_detail = r.details[key]
+            resumed = r.resumed_step
+            if resumed and resumed['key'] == key:
+                r.resumed_step = None
+                r.current_detail.resume(
+                    resumed['started_at'], resumed['count'],
+                    resumed.get('latest'))
+                detail = 'resumed'
+            else:
+                r.current_detail.start_time()
+                r.current_detail.add_detail(detail)
+            r.detail_stack.append(r.current_detail)
         logger.info(
             '[%s/%s] %s', r.current_detail.key,
             r.current_detail.description, detail)
@@ -104,33 +477,38 @@ class DetailTask(Task):
                 detail = detail % args
             except Exception as ex:  # pylint: disable=broad-except
                 logger.exception('%s', ex)
-        r.current_detail.add_detail(detail)
-        logger.info(
-            '[%s/%s] %s', r.current_detail.key,
-            r.current_detail.description, detail)
+        current = r.current_detail
+        if current is None:
+            logger.warning('[djenga]  update_step without a step: %s', detail)
+            return
+        with r.details_lock:
+            current.add_detail(detail)
+        logger.info('[%s/%s] %s', current.key, current.description, detail)
         self.save_details()
 
     def end_step(self, error=None, detail='done'):
         self.initialize_detail()
         r = self.request
-        if error:
-            r.current_detail.error = error
-            r.current_detail.add_detail(error)
-            logger.info(
-                '[%s/%s] %s', r.current_detail.key,
-                r.current_detail.description, error)
-        else:
-            r.current_detail.add_detail(detail)
-            logger.info(
-                '[%s/%s] %s', r.current_detail.key,
-                r.current_detail.description, detail)
-        r.current_detail.end_time()
-        r.detail_stack.pop()
-        if r.detail_stack:
-            r.current_detail = r.detail_stack[-1]
-        else:
-            r.current_detail = None
-        self.save_details()
+        if not r.detail_stack:
+            logger.warning('[djenga]  end_step without a started step')
+            return
+        current = r.current_detail
+        with r.details_lock:
+            if error:
+                current.error = error
+                current.add_detail(error)
+            else:
+                current.add_detail(detail)
+            current.end_time()
+            record_step(self.name, current.key, current.millis)
+            r.detail_stack.pop()
+            if r.detail_stack:
+                r.current_detail = r.detail_stack[-1]
+            else:
+                r.current_detail = r.detail_base
+        logger.info(
+            '[%s/%s] %s', current.key, current.description, error or detail)
+        self.save_details(force=self.details_flush_on_end_step)
 
     @abstractmethod
     def run(self, *args, **kwargs):
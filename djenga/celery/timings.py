@@ -0,0 +1,260 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+from bisect import bisect_left
+from threading import Event
+from threading import Lock
+from threading import Thread
+from typing import Dict
+from typing import Tuple
+
+
+__all__ = [
+    'StepTimings',
+    'enable_step_timings',
+    'disable_step_timings',
+    'record_step',
+    'step_timings_report',
+]
+logger = logging.getLogger(__name__)
+#: the upper bounds, in seconds, of the histogram buckets
+BUCKETS = (
+    0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 300, 900, 3600,
+)
+
+
+class _Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [ 0 ] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        estimates the `q` quantile by interpolating
+        within the bucket that holds it
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKETS[i - 1] if i else 0
+                upper = self.max
+                if i < len(BUCKETS):
+                    upper = max(lower, min(BUCKETS[i], upper))
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+
+def _label(value):
+    value = '%s' % (value,)
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class StepTimings:
+    """
+    Aggregates the durations of `DetailTask` steps into histograms per
+    (task name, step key) within a worker process, and periodically
+    writes them to `filename` as prometheus text (e.g., for the node
+    exporter's textfile collector) or as json.  The prometheus series
+    carry a `pid` label, so that the files of the processes of a
+    prefork worker never hold the same series.  The file is removed
+    when the timings are stopped.
+    """
+    def __init__(self, filename=None, interval=60.0, fmt='prometheus'):
+        """
+        :param filename: the file to write to; `{pid}` is replaced with
+                         the process id so that prefork workers do not
+                         overwrite each other.  None to only aggregate.
+        :param interval: the number of seconds between writes
+        :param fmt: `prometheus` or `json`
+        """
+        if fmt not in ('prometheus', 'json'):
+            raise ValueError(f'Unsupported step timings format {fmt}')
+        self.filename = filename
+        self.interval = interval
+        self.fmt = fmt
+        self.reset()
+
+    def reset(self):
+        self.lock = Lock()
+        self.histograms: Dict[Tuple[str, str], _Histogram] = {}
+        self.stopped = Event()
+        self.thread = None
+
+    def record(self, task_name, step_key, millis):
+        """
+        :param millis: the duration of the step in milliseconds
+        """
+        seconds = millis / 1000
+        with self.lock:
+            key = (task_name, '%s' % (step_key,))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram()
+            histogram.add(seconds)
+            if self.filename and self.thread is None:
+                self.thread = Thread(
+                    target=self.run, name='djenga-step-timings',
+                    daemon=True)
+                self.thread.start()
+
+    def report(self):
+        """
+        :return: a dict of (task name, step key) to a dict with the
+                 `count`, `sum`, `max`, `p50`, `p95` and `p99` of the
+                 step's duration in seconds
+        """
+        with self.lock:
+            return {
+                key: {
+                    'count': x.count,
+                    'sum': x.total,
+                    'max': x.max,
+                    'p50': x.quantile(0.5),
+                    'p95': x.quantile(0.95),
+                    'p99': x.quantile(0.99),
+                }
+                for key, x in self.histograms.items()
+            }
+
+    def prometheus(self) -> str:
+        """
+        :return: the histograms in the prometheus text format
+        """
+        name = 'djenga_step_duration_seconds'
+        lines = [
+            f'# HELP {name} the duration of DetailTask steps',
+            f'# TYPE {name} histogram',
+        ]
+        pid = os.getpid()
+        with self.lock:
+            for (task_name, step_key), x in sorted(self.histograms.items()):
+                labels = 'task="%s",step="%s",pid="%d"' % (
+                    _label(task_name), _label(step_key), pid)
+                cumulative = 0
+                for bound, n in zip(BUCKETS, x.counts):
+                    cumulative += n
+                    lines.append(
+                        f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {x.count}')
+                lines.append(f'{name}_sum{{{labels}}} {x.total}')
+                lines.append(f'{name}_count{{{labels}}} {x.count}')
+        return '\n'.join(lines) + '\n'
+
+    def json(self) -> str:
+        report = self.report()
+        return json.dumps([
+            dict(task=task_name, step=step_key, **values)
+            for (task_name, step_key), values in sorted(report.items())
+        ])
+
+    def path(self):
+        return self.filename.format(pid=os.getpid())
+
+    def flush(self):
+        """
+        writes the histograms to `filename`, atomically, so that
+        a reader never sees a partially written file
+        """
+        filename = self.path()
+        text = self.prometheus() if self.fmt == 'prometheus' else self.json()
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix='.timings')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+            os.replace(temp_name, filename)
+        except OSError:
+            os.unlink(temp_name)
+            raise
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except OSError as ex:
+                logger.warning(
+                    '[djenga]  could not write step timings: %s', ex)
+
+    def stop(self):
+        """
+        stops the background writer and removes the file, so that
+        the series of a process that is gone are no longer exported
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.filename:
+            try:
+                os.unlink(self.path())
+            except FileNotFoundError:
+                pass
+
+
+_timings: StepTimings = None
+
+
+def _reset_after_fork():
+    if _timings is not None:
+        _timings.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def enable_step_timings(filename=None, interval=60.0, fmt='prometheus'):
+    """
+    Starts aggregating the durations of the steps of every `DetailTask`
+    (including `auto_step` and `unbound_step`) in this process.  See
+    `StepTimings` for the arguments.  Call it, e.g., from a
+    `worker_process_init` signal handler, and `disable_step_timings`
+    from a `worker_process_shutdown` one, since prefork children do
+    not run `atexit` handlers.
+    :rtype: StepTimings
+    """
+    global _timings  # pylint: disable=global-statement
+    disable_step_timings()
+    _timings = StepTimings(filename, interval, fmt)
+    return _timings
+
+
+def disable_step_timings():
+    global _timings  # pylint: disable=global-statement
+    if _timings is not None:
+        _timings.stop()
+        _timings = None
+
+
+atexit.register(disable_step_timings)
+
+
+def record_step(task_name, step_key, millis):
+    timings = _timings
+    if timings is not None:
+        timings.record(task_name, step_key, millis)
+
+
+def step_timings_report():
+    """
+    :return: see `StepTimings.report`, empty when timings are disabled
+    """
+    timings = _timings
+    return timings.report() if timings is not None else {}
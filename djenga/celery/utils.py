@@ -1,6 +1,10 @@
 # encoding: utf-8
+from collections import deque
+from functools import partial
 from functools import wraps
+import inspect
 import logging
+from time import perf_counter_ns
 from celery.signals import worker_process_init
 
 
@@ -13,6 +17,11 @@ __all__ = [
     'mark_celery_running',
 ]
 log = logging.getLogger(__name__)
+#: the `QueuePipeline`s set up by `json_logging`
+_pipelines = []
+#: the number of recent progress messages kept in the task meta,
+#: override per task with a `progress_history` attribute
+PROGRESS_HISTORY = 20
 
 
 def update_progress(task, progress, *args, **kwargs):
@@ -22,6 +31,13 @@ def update_progress(task, progress, *args, **kwargs):
     to handle cases when task.request.id is None (i.e., task.request.id
     is None when a task is called as a regular function instead of with
     `delay` or `apply_async`)
+
+    Only the most recent messages are kept in `task.request.progress`
+    and in the `progress` of the task meta, along with the total
+    `progress_count`.  When the backend supports `append_progress`
+    (e.g., `RedisDetailBackend`), each message is also appended to the
+    full history, which can be read back with
+    `AsyncDetailedResult.progress`.
     :param task: celery.Task
     :param progress: format string
     :param args: args for the progress format string
@@ -30,14 +46,23 @@ def update_progress(task, progress, *args, **kwargs):
     if args:
         progress %= args
     request_id = task.request.id
-    current = getattr(task.request, 'progress', [])
+    current = getattr(task.request, 'progress', None)
+    if not isinstance(current, deque):
+        n_max = getattr(task, 'progress_history', PROGRESS_HISTORY)
+        current = deque(current or [], maxlen=n_max)
     current.append(progress)
+    count = getattr(task.request, 'progress_count', 0) + 1
     if request_id:
+        append_progress = getattr(task.backend, 'append_progress', None)
+        if append_progress:
+            append_progress(request_id, progress)
         task.backend.mark_as_started(
             request_id,
             progress='\n'.join(current),
+            progress_count=count,
             **kwargs)
     setattr(task.request, 'progress', current)
+    setattr(task.request, 'progress_count', count)
     values = getattr(task.request, 'info', {})
     for key, value in kwargs.items():
         values[key] = value
@@ -45,6 +70,80 @@ def update_progress(task, progress, *args, **kwargs):
     log.info(progress)
 
 
+def _wrap_async_generator(fn, begin, finish):
+    @wraps(fn)
+    async def decorated(*args, **kwargs):
+        state, error = begin(args), None
+        try:
+            async for x in fn(*args, **kwargs):
+                yield x
+        except Exception as ex:
+            error = '%s' % (ex,)
+            raise
+        finally:
+            finish(state, error)
+    return decorated
+
+
+def _wrap_coroutine(fn, begin, finish):
+    @wraps(fn)
+    async def decorated(*args, **kwargs):
+        state, error = begin(args), None
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as ex:
+            error = '%s' % (ex,)
+            raise
+        finally:
+            finish(state, error)
+    return decorated
+
+
+def _wrap_generator(fn, begin, finish):
+    @wraps(fn)
+    def decorated(*args, **kwargs):
+        state, error = begin(args), None
+        try:
+            return (yield from fn(*args, **kwargs))
+        except Exception as ex:
+            error = '%s' % (ex,)
+            raise
+        finally:
+            finish(state, error)
+    return decorated
+
+
+def _wrap_function(fn, begin, finish):
+    @wraps(fn)
+    def decorated(*args, **kwargs):
+        state, error = begin(args), None
+        try:
+            return fn(*args, **kwargs)
+        except Exception as ex:
+            error = '%s' % (ex,)
+            raise
+        finally:
+            finish(state, error)
+    return decorated
+
+
+def _wrap_step(fn, begin, finish):
+    """
+    wraps `fn` so that `begin(args)` is called before it starts and
+    `finish(state, error)` once it is done, where `state` is whatever
+    `begin` returned.  for coroutine functions and (async) generators,
+    "done" means once the coroutine has been awaited or the generator
+    exhausted or closed, so that timing covers their full lifetime.
+    """
+    if inspect.isasyncgenfunction(fn):
+        return _wrap_async_generator(fn, begin, finish)
+    if inspect.iscoroutinefunction(fn):
+        return _wrap_coroutine(fn, begin, finish)
+    if inspect.isgeneratorfunction(fn):
+        return _wrap_generator(fn, begin, finish)
+    return _wrap_function(fn, begin, finish)
+
+
 def auto_step(key, description=None,
               start_detail='in progress', end_detail='done'):
     """
@@ -56,26 +155,25 @@ def auto_step(key, description=None,
             @auto_step(key=1, description='eat cookies')
             def eat_cookies(self):
                 pass
+
+    Coroutine functions and generators are supported as well; their
+    step ends once they have been awaited or fully iterated.
     :param key:
     :param description:
     :param start_detail:
     :param end_detail:
     :return:
     """
+    def begin(args):
+        task = args[0]
+        task.start_step(key, description, start_detail)
+        return task
+
+    def finish(task, error):
+        task.end_step(error, end_detail)
+
     def decorator(fn):
-        @wraps(fn)
-        def decorated(self, *args, **kwargs):
-            error = None
-            self.start_step(key, description, start_detail)
-            try:
-                result = fn(self, *args, **kwargs)
-                return result
-            except Exception as ex:
-                error = '%s' % (ex,)
-                raise
-            finally:
-                self.end_step(error, end_detail)
-        return decorated
+        return _wrap_step(fn, begin, finish)
     return decorator
 
 
@@ -86,25 +184,38 @@ def unbound_step(
         end_detail='done'):
     description = description or fn.__name__
 
-    def decorated(*args, **kwargs):
-        error = None
+    def begin(args):
         task.start_step(key, description, start_detail)
-        try:
-            result = fn(*args, **kwargs)
-            return result
-        except Exception as ex:
-            error = '%s' % (ex,)
-            raise
-        finally:
-            task.end_step(error, end_detail)
 
-    return decorated
+    def finish(state, error):
+        task.end_step(error, end_detail)
+
+    return _wrap_step(fn, begin, finish)
 
 
 def substep(task, fn):
-    if task:
-        task.update_step(fn.__name__)
-    return fn
+    """
+    wraps `fn` so that each call adds a message with its name to the
+    current step of `task`, and another with its duration (or error)
+    once it is done.  use `DetailTask.bind_detail` to call it from
+    another thread.
+    """
+    if not task:
+        return fn
+    name = fn.__name__
+
+    def begin(args):
+        task.update_step(name)
+        return perf_counter_ns()
+
+    def finish(started_ns, error):
+        millis = (perf_counter_ns() - started_ns) // 1000000
+        if error:
+            task.update_step('%s failed after %d ms: %s', name, millis, error)
+        else:
+            task.update_step('%s done in %d ms', name, millis)
+
+    return _wrap_step(fn, begin, finish)
 
 
 def json_formatter(
@@ -123,16 +234,51 @@ def json_task_formatter(
         h.formatter = JsonTaskFormatter()
 
 
-def json_logging():
+def _queue_logger(logger: logging.Logger, capture_task, options, **kw):
+    """
+    celery may set up its loggers again, e.g., in each child when the
+    logfile has `%i` in it.  a logger that still has its queue is left
+    alone; one whose handlers were replaced gets a new pipeline, after
+    the old pipeline was stopped.
+    """
+    from ..logging import ContextQueueHandler
+    from ..logging import QueuePipeline
+    if any(isinstance(x, ContextQueueHandler) for x in logger.handlers):
+        return
+    for x in [ x for x in _pipelines if x.logger is logger ]:
+        x.stop()
+        _pipelines.remove(x)
+    _pipelines.append(QueuePipeline(
+        logger, capture_task=capture_task, **options))
+
+
+def json_logging(queue_size=None, overflow='drop_oldest', batch_size=100):
     """
     Initializes the celery logging so that it uses
     our custom json formatter.
+
+    With a `queue_size`, records are also formatted and written on a
+    background thread, see `djenga.logging.QueuePipeline`, so that the
+    latency of a task no longer depends on the speed of the log sinks.
+    :param queue_size: the maximum number of queued records, or None
+                       to format and write on the logging thread
+    :param overflow: `drop_oldest` or `block`, for when the queue is full
+    :param batch_size: the maximum number of records written at once
     """
     from celery.signals import after_setup_logger
     from celery.signals import after_setup_task_logger
 
     after_setup_logger.connect(json_formatter)
     after_setup_task_logger.connect(json_task_formatter)
+    if queue_size:
+        options = dict(
+            queue_size=queue_size, overflow=overflow, batch_size=batch_size)
+        after_setup_logger.connect(
+            partial(_queue_logger, capture_task=False, options=options),
+            weak=False)
+        after_setup_task_logger.connect(
+            partial(_queue_logger, capture_task=True, options=options),
+            weak=False)
 
 
 def _mark_celery_running(sender, **kwargs):
@@ -1,9 +1,22 @@
+from base64 import b64decode
+from base64 import b64encode
 from collections import OrderedDict, defaultdict
+from datetime import date
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from hashlib import sha256
+import io
+import json
 import logging
 import os
 import re
+import tempfile
+from threading import Lock
+from threading import Thread
+from time import monotonic
 from typing import Any
+from typing import Callable
 from typing import List
 from typing import Dict
 from typing import Union
@@ -18,29 +31,387 @@ __all__ = [
     'LazyKmsBunch',
 ]
 logger = logging.getLogger(__name__)
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_SNAPSHOT_VERSION = 2
+_SNAPSHOT_TAG = '__djenga_snapshot__'
+
+
+_missing = object()
+_reload_lock = Lock()
+
+
+def _looks_encrypted(value):
+    return isinstance(value, str) and value.count('|') == 4
+
+
+def _comparable(value):
+    if isinstance(value, LazySecret):
+        return (LazySecret, value.value)
+    if isinstance(value, (list, tuple)):
+        return [ _comparable(x) for x in value ]
+    if ConfigBunch.isdict(value):
+        return { key: _comparable(x) for key, x in value.items() }
+    return value
+
+
+def _diff(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, tuple]:
+    """
+    :return: `{ dotted.key: (old value, new value) }` for every leaf
+             that was added, removed or changed; missing values are None
+    """
+    changes = {}
+    for key in old.keys() | new.keys():
+        before = old.get(key)
+        after = new.get(key)
+        if isinstance(before, ConfigBunch) and isinstance(after, ConfigBunch):
+            continue
+        if isinstance(before, ConfigBunch):
+            before = None
+        if isinstance(after, ConfigBunch):
+            after = None
+        if _comparable(before) != _comparable(after):
+            changes[key] = (before, after)
+    return changes
+
+
+def _open_contents(filename: str, data: bytes):
+    """
+    :return: a text file over `data`, read from `filename`, as
+             `open(filename, 'r')` would have returned it
+    """
+    buffer = io.BytesIO(data)
+    buffer.name = filename
+    return io.TextIOWrapper(buffer)
+
+
+def _snapshot_default(value):
+    if isinstance(value, datetime):
+        return { _SNAPSHOT_TAG: 'datetime', 'value': value.isoformat() }
+    if isinstance(value, date):
+        return { _SNAPSHOT_TAG: 'date', 'value': value.isoformat() }
+    if isinstance(value, bytes):
+        return {
+            _SNAPSHOT_TAG: 'bytes',
+            'value': b64encode(value).decode('ascii'),
+        }
+    raise TypeError(f'{type(value).__name__} cannot be snapshotted')
+
+
+def _snapshot_hook(value: Dict):
+    tag = value.get(_SNAPSHOT_TAG)
+    if tag is None or len(value) != 2:
+        return value
+    if tag == 'datetime':
+        return datetime.fromisoformat(value['value'])
+    if tag == 'date':
+        return date.fromisoformat(value['value'])
+    if tag == 'bytes':
+        return b64decode(value['value'])
+    return value
+
+
+def _private_directory(directory: str) -> bool:
+    """
+    :return: True when `directory` belongs to the current user and
+             nobody else can write to it
+    """
+    if not hasattr(os, 'getuid'):
+        return True
+    info = os.stat(directory)
+    return info.st_uid == os.getuid() and not info.st_mode & 0o022
+
+
+def _snapshot_path(cache_dir: str, filenames) -> str:
+    names = '\0'.join(os.path.abspath(x) for x in filenames)
+    digest = sha256(names.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f'djenga-config-{digest[:32]}.json')
+
+
+def _read_snapshot(path: str, signature):
+    try:
+        if not _private_directory(os.path.dirname(path)):
+            logger.warning(
+                '[djenga]  ignoring snapshots in [%s], other users can '
+                'write to it', os.path.dirname(path))
+            return None
+        with open(path, 'rb') as f:
+            snapshot = json.load(f, object_hook=_snapshot_hook)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as ex:
+        logger.debug('[djenga]  ignoring unreadable snapshot [%s]: %s',
+                     path, ex)
+        return None
+    signature = [ list(x) for x in signature ]
+    if (not isinstance(snapshot, dict)
+            or snapshot.get('version') != _SNAPSHOT_VERSION
+            or snapshot.get('files') != signature):
+        return None
+    return snapshot['values']
+
+
+def _encode_snapshot(signature, values):
+    """
+    :return: the json of the snapshot, or None when the values
+             would not come back from it exactly as they are
+             (e.g., sets or non-string dict keys)
+    """
+    try:
+        text = json.dumps({
+            'version': _SNAPSHOT_VERSION,
+            'files': signature,
+            'values': values,
+        }, default=_snapshot_default)
+    except (TypeError, ValueError):
+        return None
+    if json.loads(text, object_hook=_snapshot_hook)['values'] != values:
+        return None
+    return text
+
+
+def _write_snapshot(path: str, signature, values):
+    text = _encode_snapshot(signature, values)
+    if text is None:
+        logger.debug('[djenga]  settings cannot be snapshotted [%s]', path)
+        return
+    directory = os.path.dirname(path)
+    temp_path = None
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not _private_directory(directory):
+            logger.warning(
+                '[djenga]  not writing snapshots to [%s], other users '
+                'can write to it', directory)
+            return
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+    except OSError as ex:
+        logger.debug('[djenga]  could not write snapshot [%s]: %s', path, ex)
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
 
 
 class ConfigBunch(Bunch):
+    # the bookkeeping lives in slots, so that no key from
+    # a config file can overwrite it; settings live in __dict__
+    __slots__ = (
+        '_index', '_frozen', '_filenames', '_kwargs',
+        '_subscribers', '_watcher', '_parent',
+    )
+
     def __init__(self, *filenames: str, **kwargs):
         """
         initialize with a list of files to be
         read, in order.  nested dicts
         are not supported, but you can
         use dotted key names to achieve the same effect.
+
+        every bunch keeps a flat index of `dotted.key -> value`
+        so that `get`, `[]` and `env()` are a single dict lookup.
+        the index follows every write, including attributes set
+        on nested bunches, which update the indexes of the bunches
+        above them; call `freeze` once loading is done to make the
+        config read-only.  every key is indexed, but keys that are
+        named like the bookkeeping slots (e.g., `_index`) can only be
+        read with `get` and `[]`.
         :type filenames: List[str]
+        :type cache_dir: str
         """
         super().__init__()
+        self._index: Dict[str, Any] = {}
+        self._frozen = False
+        self._parent = None
+        self._filenames = filenames
+        self._kwargs = kwargs
+        self._subscribers: List[tuple] = []
+        self._watcher = None
+        loaded = self.read_files(filenames, kwargs.get('cache_dir'))
+        for values in self.prepare_values(loaded):
+            self.assimilate_values(values)
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise TypeError(f'cannot set {name}, the config is frozen')
+        if name in ConfigBunch.__slots__ \
+                or getattr(self, '_index', None) is None:
+            super().__setattr__(name, value)
+            return
+        self._set(name, value)
+
+    def __delattr__(self, name):
+        if getattr(self, '_frozen', False):
+            raise TypeError(f'cannot delete {name}, the config is frozen')
+        if name in ConfigBunch.__slots__:
+            super().__delattr__(name)
+            return
+        previous = self.__dict__.pop(name)
+        self._reindex([ name ], _missing, previous)
+
+    def _set(self, name, value):
+        """
+        stores a setting, whatever its name, and updates the indexes
+        """
+        if self._frozen:
+            raise TypeError(f'cannot set {name}, the config is frozen')
+        previous = self.__dict__.get(name)
+        self.__dict__[name] = value
+        if isinstance(value, ConfigBunch):
+            object.__setattr__(value, '_parent', (self, name))
+        self._reindex([ name ], value, previous)
+
+    def freeze(self):
+        """
+        makes this bunch and every nested bunch read-only.  lookups
+        of keys that are not in the index no longer fall back to
+        walking the attributes, and the nested bunches drop the
+        references to their parents that kept the indexes in sync.
+        """
+        for x in self._index.values():
+            if isinstance(x, ConfigBunch) and not x._frozen:
+                x.freeze()
+        self._parent = None
+        self._frozen = True
+        return self
+
+    def reload(self) -> Dict[str, tuple]:
+        """
+        re-reads the files this bunch was created from and, if anything
+        changed, swaps in the new values in a single step.  readers
+        never block; a reader that is holding on to a nested section
+        keeps seeing the values from before the reload.
+        :return: `{ dotted.key: (old value, new value) }` for every
+                 changed key, which is also passed to the subscribers
+        """
+        if not self._filenames:
+            return {}
+        with _reload_lock:
+            fresh = type(self)(*self._filenames, **self._kwargs)
+            changes = _diff(self._index, fresh._index)
+            if not changes:
+                return changes
+            if self._frozen:
+                fresh.freeze()
+            self._swap(fresh)
+        logger.info('[djenga]  reloaded settings, %d changed', len(changes))
+        self._notify(changes)
+        return changes
+
+    def _swap(self, fresh: 'ConfigBunch'):
+        values = dict(fresh.__dict__)
+        object.__setattr__(self, '__dict__', values)
+        object.__setattr__(self, '_index', fresh._index)
+        if self._frozen:
+            return
+        for key, x in values.items():
+            if isinstance(x, ConfigBunch):
+                object.__setattr__(x, '_parent', (self, key))
+
+    def subscribe(self, fn: Callable[[Dict[str, tuple]], Any],
+                  prefix: str = None):
+        """
+        calls `fn` with `{ dotted.key: (old value, new value) }` after a
+        reload changes any key (or any key under `prefix`)
+        """
+        self._subscribers.append((fn, prefix))
+
+    def _notify(self, changes: Dict[str, tuple]):
+        for fn, prefix in list(self._subscribers):
+            if prefix:
+                selected = {
+                    key: value for key, value in changes.items()
+                    if key == prefix or key.startswith(f'{prefix}.')
+                }
+            else:
+                selected = changes
+            if not selected:
+                continue
+            try:
+                fn(selected)
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.exception('[djenga]  config subscriber failed: %s', ex)
+
+    def watch(self, interval: float = 2.0, use_inotify: bool = True):
+        """
+        starts a background thread that calls `reload` whenever one of
+        the files changes.  uses inotify when `inotify_simple` is
+        installed and polls every `interval` seconds otherwise.
+        :rtype: djenga.core.watcher.ConfigWatcher
+        """
+        from .watcher import ConfigWatcher
+        self.unwatch()
+        watcher = ConfigWatcher(self, self._filenames, interval, use_inotify)
+        object.__setattr__(self, '_watcher', watcher)
+        watcher.start()
+        return watcher
+
+    def unwatch(self):
+        watcher = self._watcher
+        if watcher:
+            object.__setattr__(self, '_watcher', None)
+            watcher.stop()
+
+    def read_files(self, filenames, cache_dir: str = None) -> List:
+        """
+        reads and parses each of the files that exists, in order.
+
+        if `cache_dir` (or the `DJENGA_CONFIG_CACHE_DIR` environment
+        variable) is set, the parsed values are saved to a snapshot
+        in that directory and reused for as long as the path, mtime and
+        sha256 of every file still match.  the snapshot holds the values
+        exactly as they appear in the files, so secrets stay encrypted.
+        snapshots are json, and they are neither read from nor
+        written to a directory that other users can write to.
+        :return: a list with the parsed values of each file
+        """
+        cache_dir = cache_dir or os.environ.get('DJENGA_CONFIG_CACHE_DIR')
+        contents = []
         for x in filenames:
             try:
-                with open(x, 'r') as f:
+                with open(x, 'rb') as f:
                     logger.debug('[djenga]  loading settings from [%s]', x)
-                    values = self.load_file(f)
-                    self.assimilate_values(values)
+                    mtime = os.fstat(f.fileno()).st_mtime_ns
+                    contents.append((x, mtime, f.read()))
             except FileNotFoundError:
                 logger.debug('[djenga]  file [%s] was not found, skipping.', x)
+        if not cache_dir:
+            return self.parse(contents)
+        signature = [
+            (os.path.abspath(x), mtime, sha256(data).hexdigest())
+            for x, mtime, data in contents
+        ]
+        path = _snapshot_path(cache_dir, filenames)
+        values = _read_snapshot(path, signature)
+        if values is None:
+            values = self.parse(contents)
+            _write_snapshot(path, signature, values)
+        else:
+            logger.debug('[djenga]  loaded settings snapshot [%s]', path)
+        return values
+
+    def parse(self, contents: List[tuple]) -> List:
+        """
+        :param contents: a list of (filename, mtime, bytes read)
+        """
+        return [
+            self.load_file(_open_contents(x, data))
+            for x, _, data in contents
+        ]
+
+    def prepare_values(self, loaded: List) -> List:
+        """
+        a hook for subclasses to transform the values read from
+        the files, e.g., to decrypt secrets, before they are stored
+        :param loaded: see `read_files`
+        """
+        return loaded
 
     def load_file(self, f):
-        values: Dict[str, Any] = yaml.load(f, yaml.SafeLoader)
+        """
+        :param f: an open text file
+        """
+        values: Dict[str, Any] = yaml.load(f, _Loader)
         return values
 
     def assimilate_values(self, values):
@@ -49,67 +420,114 @@ class ConfigBunch(Bunch):
             return
         for key, value in values.items():
             pieces: List[str] = key.split('.')
-            parent = self.create_to_parent(pieces)
+            self._store(pieces, value)
+
+    def _store(self, pieces: List[str], value):
+        parent = self.create_to_parent(pieces)
+        if isinstance(parent, ConfigBunch):
+            parent._set(pieces[-1], value)
+        else:
             setattr(parent, pieces[-1], value)
 
+    def _reindex(self, pieces: List[str], value, previous):
+        """
+        updates the index of this bunch, and of every bunch above it,
+        after the value at `pieces` was replaced (or deleted when
+        `value` is `_missing`)
+        """
+        node = self
+        while True:
+            node._index_path(pieces, value, previous)
+            parent = node._parent
+            if parent is None:
+                return
+            parent, key = parent
+            # a section that was replaced (or reloaded away) no
+            # longer belongs to the index of its old parent
+            if parent.__dict__.get(key) is not node:
+                return
+            node, pieces = parent, [ key ] + pieces
+
+    def _index_path(self, pieces: List[str], value, previous):
+        dotted = '.'.join(pieces)
+        prefix = dotted + '.'
+        if isinstance(previous, ConfigBunch):
+            stale = [ x for x in self._index if x.startswith(prefix) ]
+            for x in stale:
+                del self._index[x]
+        if value is _missing:
+            self._index.pop(dotted, None)
+            return
+        self._index[dotted] = value
+        if isinstance(value, ConfigBunch):
+            for key, x in value._index.items():
+                self._index[prefix + key] = x
+
     def create_to_parent(self, pieces: List[str]) -> 'ConfigBunch':
         parent: ConfigBunch = self
         for y in pieces[:-1]:
-            if not hasattr(parent, y):
+            child = vars(parent).get(y, _missing)
+            if child is _missing:
                 child = ConfigBunch()
-                setattr(parent, y, child)
-            else:
-                child = getattr(parent, y)
+                parent._set(y, child)
             parent = child
         return parent
 
     def walk_to_parent(self, pieces: List[str]) -> 'ConfigBunch':
         parent: ConfigBunch = self
         for x in pieces[:-1]:
-            parent = getattr(parent, x, None)
+            parent = vars(parent).get(x)
             if not isinstance(parent, Bunch):
                 return None
         return parent
 
-    def get(self, key, default=None):
+    def _lookup(self, key, default):
+        value = self._index.get(key, _missing)
+        if value is not _missing or self._frozen:
+            return value
+        # attributes set before the index existed are not indexed
         pieces = key.split('.')
         parent = self.walk_to_parent(pieces)
         if parent:
-            return getattr(parent, pieces[-1], default)
+            return parent.__dict__.get(pieces[-1], default)
         return default
 
+    def get(self, key, default=None):
+        value = self._lookup(key, _missing)
+        return default if value is _missing else value
+
     def __getitem__(self, key):
-        pieces = key.split('.')
-        parent = self.walk_to_parent(pieces)
-        if parent:
-            return getattr(parent, pieces[-1])
-        raise KeyError(f'{key} not found in config')
+        value = self._lookup(key, _missing)
+        if value is _missing:
+            raise KeyError(f'{key} not found in config')
+        return value
 
     def __setitem__(self, key, value):
-        pieces = key.split('.')
-        parent = self.create_to_parent(pieces)
-        setattr(parent, pieces[-1], value)
+        self._store(key.split('.'), value)
 
     def setdefault(self, key, value):
-        pieces = key.split('.')
-        parent = self.create_to_parent(pieces)
-        key = pieces[-1]
-        if hasattr(parent, key):
-            return getattr(parent, key)
-        setattr(parent, key, value)
+        current = self._lookup(key, _missing)
+        if current is not _missing:
+            return current
+        self._store(key.split('.'), value)
         return value
 
     def env(self):
         splitter = re.compile(r'[_.]')
+        translated: Dict[str, str] = {}
 
         def fn(key, default=None):
             value = os.environ.get(key)
             if not value:
-                pieces = splitter.split(key.lower())
-                parent: ConfigBunch = self.walk_to_parent(pieces)
-                if not isinstance(parent, ConfigBunch):
+                dotted = translated.get(key)
+                if dotted is None:
+                    dotted = '.'.join(splitter.split(key.lower()))
+                    translated[key] = dotted
+                parent, _, _ = dotted.rpartition('.')
+                if parent and not isinstance(
+                        self.get(parent), ConfigBunch):
                     return None
-                value = parent.get(pieces[-1], default)
+                value = self.get(dotted, default)
             return value
         return fn
 
@@ -125,47 +543,126 @@ class KmsBunch(ConfigBunch):
         read, in order.  nested dicts
         are not supported, but you can
         use dotted key names to achieve the same effect.
+        every value that looks like a kms wrapped secret is
+        decrypted once all of the files have been read, using
+        up to `max_workers` threads.
         :type filenames: List[str]
         :type kms_key_id: str
         :type profile: str
         :type region: str
+        :type max_workers: int
+        :type cache_dir: str
         """
-        super().__init__()
         self.profile: str = kwargs.get('profile', None)
         self.region: str = kwargs.get('region', None)
-        for x in filenames:
-            try:
-                with open(x, 'r') as f:
-                    logger.debug('[djenga]  loading settings from [%s]', x)
-                    values = self.load_file(f)
-                    values = self.decrypt(values)
-                    self.assimilate_values(values)
-            except FileNotFoundError:
-                logger.debug('[djenga]  file [%s] was not found, skipping.', x)
+        self.max_workers: int = kwargs.get('max_workers', 8)
+        super().__init__(*filenames, **kwargs)
 
-    def decrypt(self, values):
-        from ..encryption.kms_wrapped import decrypt
+    def prepare_values(self, loaded: List) -> List:
+        secrets = set()
+        for values in loaded:
+            self.collect_secrets(values, secrets)
+        decrypted = self.decrypt_all(secrets)
+        return [ self.replace_secrets(x, decrypted) for x in loaded ]
+
+    def collect_secrets(self, values, secrets: set):
+        if isinstance(values, (list, tuple)):
+            for x in values:
+                self.collect_secrets(x, secrets)
+        elif ConfigBunch.isdict(values):
+            for x in values.values():
+                self.collect_secrets(x, secrets)
+        elif _looks_encrypted(values):
+            secrets.add(values)
+        return secrets
+
+    def replace_secrets(self, values, decrypted: Dict[str, str]):
         if isinstance(values, (list, tuple)):
-            return [ self.decrypt(x) for x in values ]
+            return [ self.replace_secrets(x, decrypted) for x in values ]
         if ConfigBunch.isdict(values):
             return {
-                key: self.decrypt(value)
+                key: self.replace_secrets(value, decrypted)
                 for key, value in values.items()
             }
+        if _looks_encrypted(values):
+            return decrypted.get(values, values)
+        return values
+
+    def decrypt_one(self, value):
+        from ..encryption.kms_wrapped import decrypt
         try:
-            return decrypt(values, region=self.region, profile=self.profile)
+            return decrypt(value, region=self.region, profile=self.profile)
         except:  # noqa: E722, pylint: disable=bare-except,
-            return values
+            return value
+
+    def decrypt_all(self, secrets) -> Dict[str, str]:
+        """
+        decrypts each distinct secret concurrently.  each worker
+        thread uses its own kms client.
+        :return: a dict of cipher text to plain text.  secrets
+                 that cannot be decrypted map to themselves.
+        """
+        secrets = list(secrets)
+        if len(secrets) < 2 or self.max_workers < 2:
+            return { x: self.decrypt_one(x) for x in secrets }
+        n_workers = min(self.max_workers, len(secrets))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            return dict(zip(secrets, executor.map(self.decrypt_one, secrets)))
+
+    def decrypt(self, values):
+        secrets = self.collect_secrets(values, set())
+        decrypted = self.decrypt_all(secrets)
+        return self.replace_secrets(values, decrypted)
 
 
 class LazySecret:
-    def __init__(self, value=None, decrypt_fn=None):
+    def __init__(self, value=None, decrypt_fn=None, ttl=None):
+        """
+        :param value: the encrypted value
+        :param decrypt_fn: called with `value` the first time
+                           the secret is needed
+        :param ttl: the number of seconds to keep the decrypted value,
+                    None keeps it until `value` changes
+        """
         self.decrypted = False
-        self.value = value
         self.decrypt = decrypt_fn
+        self.ttl = ttl
+        self._value = value
+        self._plain_text = None
+        self._expires = None
+        self._lock = Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        """
+        assigning a new (e.g., rotated) encrypted value
+        discards the cached plain text
+        """
+        with self._lock:
+            self._value = value
+            self.decrypted = False
+
+    def is_fresh(self):
+        return self.decrypted and (
+            self._expires is None or monotonic() < self._expires)
 
     def get(self):
-        return self.decrypt(self.value)
+        if self.is_fresh():
+            return self._plain_text
+        with self._lock:
+            if not self.is_fresh():
+                self._plain_text = self.decrypt(self._value)
+                if self.ttl is not None:
+                    self._expires = monotonic() + self.ttl
+                self.decrypted = True
+            return self._plain_text
+
+    def invalidate(self):
+        self.decrypted = False
 
 
 class LazyKmsBunch(ConfigBunch):
@@ -179,22 +676,19 @@ class LazyKmsBunch(ConfigBunch):
         :type kms_key_id: str
         :type profile: str
         :type region: str
+        :type secret_ttl: int
+        :type cache_dir: str
         """
         from ..encryption.kms_wrapped import decrypt
-        super().__init__()
         self.profile: str = kwargs.get('profile', None)
         self.region: str = kwargs.get('region', None)
+        self.secret_ttl: int = kwargs.get('secret_ttl', None)
         self.decrypt_fn = partial(
             decrypt, region=self.region, profile=self.profile)
-        for x in filenames:
-            try:
-                with open(x, 'r') as f:
-                    logger.debug('[djenga]  loading settings from [%s]', x)
-                    values = self.load_file(f)
-                    values = self.lazy_wrap(values)
-                    self.assimilate_values(values)
-            except FileNotFoundError:
-                logger.debug('[djenga]  file [%s] was not found, skipping.', x)
+        super().__init__(*filenames, **kwargs)
+
+    def prepare_values(self, loaded: List) -> List:
+        return [ self.lazy_wrap(x) for x in loaded ]
 
     def lazy_wrap(self, values: Union[Dict, List, str]):
         if isinstance(values, (list, tuple)):
@@ -204,6 +698,46 @@ class LazyKmsBunch(ConfigBunch):
                 key: self.lazy_wrap(value)
                 for key, value in values.items()
             }
-        if isinstance(values, str) and values.count('|') == 4:
-            return LazySecret(values, self.decrypt_fn)
+        if _looks_encrypted(values):
+            return LazySecret(values, self.decrypt_fn, self.secret_ttl)
         return values
+
+    def lazy_secrets(self, keys: List[str] = None) -> List[LazySecret]:
+        """
+        :param keys: dotted keys of secrets or of sections containing
+                     secrets.  None means every secret in the config.
+        """
+        stack = [ self ] if keys is None else [ self.get(x) for x in keys ]
+        secrets = []
+        while stack:
+            x = stack.pop()
+            if isinstance(x, LazySecret):
+                secrets.append(x)
+            elif isinstance(x, Bunch):
+                stack.extend(vars(x).values())
+            elif ConfigBunch.isdict(x):
+                stack.extend(x.values())
+            elif isinstance(x, (list, tuple)):
+                stack.extend(x)
+        return secrets
+
+    def prefetch(self, keys: List[str] = None) -> Thread:
+        """
+        decrypts the selected secrets on a background thread so that
+        the first request that needs them does not wait on kms.
+        :param keys: see `lazy_secrets`
+        :return: the started thread, in case the caller wants to `join`
+        """
+        secrets = self.lazy_secrets(keys)
+
+        def warm():
+            for x in secrets:
+                try:
+                    x.get()
+                except Exception as ex:  # pylint: disable=broad-except
+                    logger.warning('[djenga]  prefetch failed: %s', ex)
+            logger.debug('[djenga]  prefetched %d secrets', len(secrets))
+
+        thread = Thread(target=warm, name='djenga-prefetch', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,84 @@
+import logging
+import os
+from threading import Event
+from threading import Thread
+try:
+    from inotify_simple import INotify
+    from inotify_simple import flags
+except ImportError:
+    INotify = None
+    flags = None
+
+
+__all__ = [
+    'ConfigWatcher',
+]
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher(Thread):
+    """
+    Reloads a `ConfigBunch` whenever one of the files it was read from
+    changes.  Changes are detected by comparing the mtime and size of
+    every file.  When `inotify_simple` is installed, the watcher sleeps
+    on inotify events for the directories holding those files and only
+    falls back to checking every `interval` seconds; otherwise it polls.
+    """
+    def __init__(self, config, filenames, interval=2.0, use_inotify=True):
+        """
+        :type config: djenga.core.ConfigBunch
+        :type filenames: List[str]
+        :param interval: the number of seconds between checks
+        :param use_inotify: set to False to always poll
+        """
+        super().__init__(name='djenga-config-watcher', daemon=True)
+        self.config = config
+        self.filenames = [ os.path.abspath(x) for x in filenames ]
+        self.interval = interval
+        self.stopped = Event()
+        self.last = self.signature()
+        self.inotify = None
+        if use_inotify and INotify is not None:
+            self.inotify = INotify()
+            mask = (
+                flags.CLOSE_WRITE | flags.MOVED_TO
+                | flags.CREATE | flags.DELETE
+            )
+            for x in { os.path.dirname(x) for x in self.filenames }:
+                if os.path.isdir(x):
+                    self.inotify.add_watch(x, mask)
+
+    def signature(self):
+        result = []
+        for x in self.filenames:
+            try:
+                st = os.stat(x)
+                result.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                result.append(None)
+        return result
+
+    def wait(self):
+        if self.inotify:
+            self.inotify.read(timeout=int(1000 * self.interval))
+        else:
+            self.stopped.wait(self.interval)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wait()
+            current = self.signature()
+            if current == self.last or self.stopped.is_set():
+                continue
+            self.last = current
+            try:
+                self.config.reload()
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.exception('[djenga]  config reload failed: %s', ex)
+        if self.inotify:
+            self.inotify.close()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.is_alive():
+            self.join(timeout)
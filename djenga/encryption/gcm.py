@@ -1,13 +1,23 @@
 # encoding: utf-8
 
 import logging
+import os
+import struct
 from base64 import b64decode
 from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
 from Crypto.Protocol.KDF import PBKDF2 as derive_key
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 from django.conf import settings
+from ..utils.list_utils import chunkify_iterable
 from .helpers import _as_bytes
+from .helpers import _LruCache
+from .helpers import _setting
 
 
 __all__ = [
@@ -15,6 +25,12 @@ __all__ = [
     u'encrypt_bytes',
     u'decrypt',
     u'decrypt_bytes',
+    u'encrypt_many',
+    u'decrypt_many',
+    u'is_binary',
+    u'key_cache_info',
+    u'clear_key_cache',
+    u'configure_key_cache',
 ]
 
 
@@ -26,6 +42,96 @@ def _prep_key(key=None):
     return _as_bytes(key)
 
 
+class _DerivedKeyCache(_LruCache):
+    """
+    A bounded, thread-safe lru cache of
+    `(key fingerprint, kdf_salt) -> derived key`.  The raw key is never
+    stored; entries are keyed by the sha256 digest of the key.  PBKDF2
+    runs outside of the lock so that concurrent misses do not serialize.
+    """
+    def derive(self, key, kdf_salt):
+        # str and bytes keys are fed to PBKDF2 differently,
+        # so they must not share a fingerprint
+        cache_key = (
+            isinstance(key, str), sha256(_as_bytes(key)).digest(), kdf_salt)
+        derived_key = self.get(cache_key)
+        if derived_key is None:
+            derived_key = derive_key(key, kdf_salt, 32)
+            self.put(cache_key, derived_key)
+        return derived_key
+
+
+_key_cache = None
+_key_cache_lock = Lock()
+
+
+def _get_key_cache():
+    global _key_cache  # pylint: disable=global-statement
+    if _key_cache is None:
+        with _key_cache_lock:
+            if _key_cache is None:
+                _key_cache = _DerivedKeyCache(
+                    _setting('DJENGA_ENCRYPTION_KEY_CACHE_SIZE', 256),
+                    _setting('DJENGA_ENCRYPTION_KEY_CACHE_TTL', None),
+                )
+    return _key_cache
+
+
+def configure_key_cache(max_size=256, ttl=None):
+    """
+    Replaces the derived key cache with an empty one of the given size.
+    By default, the cache is sized from the
+    `DJENGA_ENCRYPTION_KEY_CACHE_SIZE` and `DJENGA_ENCRYPTION_KEY_CACHE_TTL`
+    settings on first use.
+    :param max_size: the maximum number of derived keys to hold,
+                     0 disables the cache
+    :param ttl: the number of seconds a derived key stays valid
+    """
+    global _key_cache  # pylint: disable=global-statement
+    with _key_cache_lock:
+        _key_cache = _DerivedKeyCache(max_size, ttl)
+
+
+def clear_key_cache():
+    """
+    Empties the derived key cache and resets its statistics, e.g.,
+    after rotating `DJENGA_ENCRYPTION_KEY`.
+    """
+    _get_key_cache().clear()
+
+
+def key_cache_info():
+    """
+    :return: a dict with the `hits`, `misses`, `size`, `max_size`
+             and `ttl` of the derived key cache
+    """
+    return _get_key_cache().info()
+
+
+_salt_lock = Lock()
+_salt_epoch = (None, None, 0.0)
+
+
+def _epoch_salt():
+    """
+    Returns a kdf salt that is shared by every encrypt in this process
+    for `DJENGA_ENCRYPTION_SALT_WINDOW` seconds (default 3600), so that
+    the derived key can be served from the cache.  Each value still gets
+    its own random gcm nonce.  A forked child never reuses the salt of
+    its parent.
+    """
+    global _salt_epoch  # pylint: disable=global-statement
+    window = _setting('DJENGA_ENCRYPTION_SALT_WINDOW', 3600)
+    pid = os.getpid()
+    now = monotonic()
+    with _salt_lock:
+        epoch_pid, kdf_salt, started = _salt_epoch
+        if epoch_pid != pid or not kdf_salt or now - started >= window:
+            kdf_salt = get_random_bytes(32)
+            _salt_epoch = (pid, kdf_salt, now)
+    return kdf_salt
+
+
 def _gcm_pack(header, cipher_text, tag, nonce, kdf_salt):
     values = [ header, cipher_text, tag, nonce, kdf_salt ]
     values = [ b64encode(x).decode('utf-8') for x in values ]
@@ -40,7 +146,77 @@ def _gcm_unpack(value):
     return values
 
 
-def encrypt(plain_text, key=None, auth_header='djenga'):
+# binary envelope:  magic byte, version byte, the five field lengths
+# as unsigned 32-bit ints and then the fields themselves, in the same
+# order as the text format.  the magic byte is outside of the base64
+# alphabet so the two formats can never be confused.
+_MAGIC = 0xde
+_VERSION = 1
+_ENVELOPE = struct.Struct('>BB5I')
+
+
+def _gcm_pack_binary(header, cipher_text, tag, nonce, kdf_salt):
+    values = [ header, cipher_text, tag, nonce, kdf_salt ]
+    lengths = [ len(x) for x in values ]
+    return b''.join([ _ENVELOPE.pack(_MAGIC, _VERSION, *lengths) ] + values)
+
+
+def _gcm_unpack_binary(value):
+    """
+    unpacks a binary envelope without copying; the pieces are
+    memoryview slices of `value`
+    """
+    view = memoryview(value)
+    if len(view) < _ENVELOPE.size:
+        raise ValueError('Binary value is shorter than its envelope')
+    magic, version, *lengths = _ENVELOPE.unpack_from(view)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f'Unsupported binary envelope {magic}/{version}')
+    offset = _ENVELOPE.size
+    values = []
+    for n in lengths:
+        values.append(view[offset:offset + n])
+        offset += n
+    if offset != len(view):
+        raise ValueError('Binary value length does not match its envelope')
+    return values
+
+
+_PACKERS = {
+    'text': _gcm_pack,
+    'binary': _gcm_pack_binary,
+}
+
+
+def _get_packer(format):  # pylint: disable=redefined-builtin
+    if format not in _PACKERS:
+        raise ValueError(f'Unsupported format {format}')
+    return _PACKERS[format]
+
+
+def is_binary(packed_value):
+    """
+    :return: True if `packed_value` uses the binary envelope
+             rather than the pipe-delimited text format
+    """
+    return (
+        isinstance(packed_value, (bytes, bytearray, memoryview))
+        and len(packed_value) > 0
+        and packed_value[0] == _MAGIC
+    )
+
+
+def _unpack(packed_value):
+    if is_binary(packed_value):
+        return _gcm_unpack_binary(packed_value)
+    if isinstance(packed_value, (bytes, bytearray, memoryview)):
+        packed_value = bytes(packed_value).decode('utf-8')
+    return _gcm_unpack(packed_value)
+
+
+def encrypt(  # pylint: disable=redefined-builtin
+        plain_text, key=None, auth_header='djenga',
+        reuse_salt=False, format='text'):
     """
     The encrypt function encrypts a unicode string using the
     Blowfish cipher (provided by pycrypto).  The key used is
@@ -49,14 +225,19 @@ def encrypt(plain_text, key=None, auth_header='djenga'):
     :param plain_text: The plaintext unicode string to be encrypted.
     :param key: the password to use for encryption
     :param auth_header: str
+    :param reuse_salt: use the per-process kdf salt instead of a fresh one
+    :param format: `text` for the pipe-delimited str format, or
+                   `binary` for the compact bytes envelope
     :return The encrypted ciphertext.
 
     """
     plain_text = _as_bytes(plain_text)
-    return encrypt_bytes(plain_text, key, auth_header)
+    return encrypt_bytes(plain_text, key, auth_header, reuse_salt, format)
 
 
-def encrypt_bytes(plain_text, key=None, auth_header='djenga'):
+def encrypt_bytes(  # pylint: disable=redefined-builtin
+        plain_text, key=None, auth_header='djenga',
+        reuse_salt=False, format='text'):
     """
     The encrypt function encrypts a unicode string using the
     Blowfish cipher (provided by pycrypto).  The key used is
@@ -65,18 +246,30 @@ def encrypt_bytes(plain_text, key=None, auth_header='djenga'):
     :param plain_text: The plaintext unicode string to be encrypted.
     :param key: the password to use for encryption
     :param auth_header: str
+    :param reuse_salt: use the per-process kdf salt instead of a fresh one
+    :param format: `text` for the pipe-delimited str format, or
+                   `binary` for the compact bytes envelope
     :return The encrypted ciphertext.
 
     """
-    kdf_salt = get_random_bytes(32)
+    pack = _get_packer(format)
     key = key or settings.DJENGA_ENCRYPTION_KEY
-    derived_key = derive_key(key, kdf_salt, 32)
-    cipher = AES.new(derived_key, AES.MODE_GCM)
+    if reuse_salt:
+        kdf_salt = _epoch_salt()
+        derived_key = _get_key_cache().derive(key, kdf_salt)
+    else:
+        kdf_salt = get_random_bytes(32)
+        derived_key = derive_key(key, kdf_salt, 32)
     auth_header = _as_bytes(auth_header)
+    return _gcm_encrypt(plain_text, derived_key, auth_header, kdf_salt, pack)
+
+
+def _gcm_encrypt(plain_text, derived_key, auth_header, kdf_salt, pack):
+    cipher = AES.new(derived_key, AES.MODE_GCM)
     cipher.update(auth_header)
     cipher_text, tag = cipher.encrypt_and_digest(plain_text)
     nonce = cipher.nonce
-    return _gcm_pack(auth_header, cipher_text, tag, nonce, kdf_salt)
+    return pack(auth_header, cipher_text, tag, nonce, kdf_salt)
 
 
 def decrypt(packed_value, key=None):
@@ -91,7 +284,8 @@ def decrypt_bytes(packed_value, key=None):
     The cipher used is Blowfish (provided by pcrypto), and the
     key used is the SECRET_KEY specified in the settings file.
 
-    :param packed_value: The encrypted pieces needed for decryption.
+    :param packed_value: The encrypted pieces needed for decryption,
+                         in either the text or the binary format.
     :param key: the password to use when encrypting
     :return The decrypted plaintext (unicode) string.
 
@@ -101,15 +295,102 @@ def decrypt_bytes(packed_value, key=None):
     >>> decrypt(encrypt(st, key.bytes), key.bytes) == st
     True
     """
-    header, cipher_text, tag, nonce, kdf_salt = _gcm_unpack(packed_value)
+    header, cipher_text, tag, nonce, kdf_salt = _unpack(packed_value)
     key = key or settings.DJENGA_ENCRYPTION_KEY
-    decryption_key = derive_key(key, kdf_salt, 32)
-    cipher = AES.new(decryption_key, AES.MODE_GCM, nonce)
+    decryption_key = _get_key_cache().derive(key, bytes(kdf_salt))
+    cipher = AES.new(decryption_key, AES.MODE_GCM, bytes(nonce))
     cipher.update(header)
     data = cipher.decrypt_and_verify(cipher_text, tag)
     return data
 
 
+def _encrypt_chunk(plain_texts, key, auth_header, pack):
+    """
+    encrypts a chunk of values with a single kdf salt so that
+    the whole chunk only pays for one key derivation
+    """
+    kdf_salt = get_random_bytes(32)
+    derived_key = derive_key(key, kdf_salt, 32)
+    auth_header = _as_bytes(auth_header)
+    results = []
+    for x in plain_texts:
+        try:
+            value = _gcm_encrypt(
+                _as_bytes(x), derived_key, auth_header, kdf_salt, pack)
+        except Exception as ex:  # pylint: disable=broad-except
+            value = ex
+        results.append(value)
+    return results
+
+
+def _decrypt_chunk(packed_values, key):
+    results = []
+    for x in packed_values:
+        try:
+            value = decrypt_bytes(x, key)
+        except Exception as ex:  # pylint: disable=broad-except
+            value = ex
+        results.append(value)
+    return results
+
+
+def _map_chunks(fn, values, workers, chunk_size):
+    chunks = chunkify_iterable(values, chunk_size)
+    if workers:
+        with ProcessPoolExecutor(workers) as executor:
+            for chunk in executor.map(fn, chunks):
+                yield from chunk
+    else:
+        for chunk in chunks:
+            yield from fn(chunk)
+
+
+def encrypt_many(  # pylint: disable=redefined-builtin
+        plain_texts, key=None, auth_header='djenga',
+        workers=None, chunk_size=1000, format='text'):
+    """
+    Encrypts many values at once.  Each chunk of values shares a
+    single kdf salt (and hence a single PBKDF2 run), while every value
+    still gets its own gcm nonce.
+
+    :param plain_texts: an iterable of str or bytes values
+    :param key: the password to use for encryption
+    :param auth_header: str
+    :param workers: if given, the number of processes to spread the
+                    chunks across
+    :param chunk_size: the number of values handed to a worker at a time
+    :param format: `text` or `binary`, see `encrypt_bytes`
+    :return: a list of packed values in the same order as `plain_texts`.
+             a value that could not be encrypted is replaced by the
+             exception that was raised for it.
+    """
+    pack = _get_packer(format)
+    key = key or settings.DJENGA_ENCRYPTION_KEY
+    fn = partial(
+        _encrypt_chunk, key=key, auth_header=auth_header, pack=pack)
+    return list(_map_chunks(fn, plain_texts, workers, chunk_size))
+
+
+def decrypt_many(packed_values, key=None, workers=None, chunk_size=1000):
+    """
+    Decrypts many packed values at once.  Derived keys are shared
+    across values with the same kdf salt by the key cache.
+
+    :param packed_values: an iterable of values from `encrypt`,
+                          in either format
+    :param key: the password to use when decrypting
+    :param workers: if given, the number of processes to spread the
+                    chunks across
+    :param chunk_size: the number of values handed to a worker at a time
+    :return: a list of decrypted bytes in the same order as
+             `packed_values`.  a value that could not be decrypted
+             is replaced by the exception that was raised for it.
+    """
+    key = key or settings.DJENGA_ENCRYPTION_KEY
+    fn = partial(_decrypt_chunk, key=key)
+    return list(_map_chunks(fn, packed_values, workers, chunk_size))
+
+
 def _test_me():
     import uuid
     plain_text = 'Hello sesame!'
@@ -0,0 +1,182 @@
+# encoding: utf-8
+"""
+Streaming aes-gcm encryption for payloads that are too large to hold
+in memory.  The plaintext is cut into fixed-size segments and each
+segment is sealed on its own, so memory use is bounded by the segment
+size and a corrupted segment is reported as soon as it is read.
+
+A stream is laid out as:
+
+    magic (1) | version (1) | segment size (4) | header length (4)
+    | header | kdf salt (32) | nonce prefix (7)
+    | segment 0 | tag 0 | segment 1 | tag 1 | ...
+
+Every segment is encrypted with the key derived from the password and
+the kdf salt, exactly as in `djenga.encryption.gcm`, with the preamble
+as additional authenticated data.  The 12-byte nonce of segment `i` is
+the nonce prefix, `i` as a 4-byte counter and a final byte that is 1
+only for the last segment, so segments cannot be reordered, dropped
+or truncated without detection.
+"""
+from collections import namedtuple
+import struct
+from Crypto.Cipher import AES
+from Crypto.Protocol.KDF import PBKDF2 as derive_key
+from Crypto.Random import get_random_bytes
+from django.conf import settings
+from .gcm import _get_key_cache
+from .helpers import _as_bytes
+
+
+__all__ = [
+    u'encrypt_stream',
+    u'decrypt_stream',
+    u'read_preamble',
+    u'Preamble',
+]
+
+
+_MAGIC = 0xdf
+_VERSION = 1
+_PREAMBLE = struct.Struct('>BBII')
+_SALT_SIZE = 32
+_PREFIX_SIZE = 7
+_TAG_SIZE = 16
+_MAX_SEGMENTS = 2 ** 32
+_MAX_SEGMENT_SIZE = 2 ** 32
+DEFAULT_SEGMENT_SIZE = 64 * 1024
+
+Preamble = namedtuple(
+    'Preamble', 'raw header kdf_salt nonce_prefix segment_size')
+
+
+def _read_exactly(src, n):
+    """
+    reads up to `n` bytes, only returning fewer when
+    the end of the stream has been reached
+    """
+    data = src.read(n)
+    if len(data) == n or not data:
+        return data
+    pieces = [ data ]
+    remaining = n - len(data)
+    while remaining:
+        data = src.read(remaining)
+        if not data:
+            break
+        pieces.append(data)
+        remaining -= len(data)
+    return b''.join(pieces)
+
+
+def _nonce(nonce_prefix, index, last):
+    if index >= _MAX_SEGMENTS:
+        raise ValueError('Stream has too many segments')
+    return nonce_prefix + struct.pack('>IB', index, 1 if last else 0)
+
+
+def read_preamble(src) -> Preamble:
+    """
+    reads the preamble of an encrypted stream, leaving `src`
+    positioned at the first segment.  useful when the key
+    depends on the header, e.g., for kms wrapped data keys.
+    """
+    fixed = _read_exactly(src, _PREAMBLE.size)
+    if len(fixed) != _PREAMBLE.size:
+        raise ValueError('Stream is shorter than its preamble')
+    magic, version, segment_size, n_header = _PREAMBLE.unpack(fixed)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f'Unsupported stream format {magic}/{version}')
+    if not segment_size:
+        raise ValueError('Stream has an empty segment size')
+    rest = _read_exactly(src, n_header + _SALT_SIZE + _PREFIX_SIZE)
+    if len(rest) != n_header + _SALT_SIZE + _PREFIX_SIZE:
+        raise ValueError('Stream is shorter than its preamble')
+    header = rest[:n_header]
+    kdf_salt = rest[n_header:n_header + _SALT_SIZE]
+    nonce_prefix = rest[n_header + _SALT_SIZE:]
+    return Preamble(
+        fixed + rest, header, kdf_salt, nonce_prefix, segment_size)
+
+
+def encrypt_stream(src, dst, key=None, auth_header='djenga',
+                   segment_size=DEFAULT_SEGMENT_SIZE):
+    """
+    Encrypts everything readable from `src` and writes the
+    encrypted stream to `dst`.
+
+    :param src: a binary file-like object to read plaintext from
+    :param dst: a binary file-like object to write to
+    :param key: the password to use for encryption
+    :param auth_header: str or bytes stored, and authenticated,
+                        in the preamble
+    :param segment_size: the number of plaintext bytes per segment,
+                         at least 1 and less than 2 ** 32
+    :return: the number of plaintext bytes that were encrypted
+    """
+    if not 0 < segment_size < _MAX_SEGMENT_SIZE:
+        raise ValueError(f'Unsupported segment size {segment_size}')
+    key = key or settings.DJENGA_ENCRYPTION_KEY
+    header = _as_bytes(auth_header)
+    kdf_salt = get_random_bytes(_SALT_SIZE)
+    nonce_prefix = get_random_bytes(_PREFIX_SIZE)
+    derived_key = derive_key(key, kdf_salt, 32)
+    preamble = b''.join([
+        _PREAMBLE.pack(_MAGIC, _VERSION, segment_size, len(header)),
+        header, kdf_salt, nonce_prefix,
+    ])
+    dst.write(preamble)
+    index = n_bytes = 0
+    segment = _read_exactly(src, segment_size)
+    while True:
+        following = _read_exactly(src, segment_size) if segment else b''
+        last = not following
+        nonce = _nonce(nonce_prefix, index, last)
+        cipher = AES.new(derived_key, AES.MODE_GCM, nonce)
+        cipher.update(preamble)
+        cipher_text, tag = cipher.encrypt_and_digest(segment)
+        dst.write(cipher_text)
+        dst.write(tag)
+        n_bytes += len(segment)
+        if last:
+            return n_bytes
+        index += 1
+        segment = following
+
+
+def decrypt_stream(src, dst, key=None, preamble: Preamble = None):
+    """
+    Decrypts a stream written by `encrypt_stream`.  Segments are
+    verified one at a time, so a `ValueError` is raised at the first
+    corrupted segment; anything written to `dst` before that point
+    came from segments that did verify.
+
+    :param src: a binary file-like object to read the stream from
+    :param dst: a binary file-like object to write plaintext to
+    :param key: the password to use when decrypting
+    :param preamble: the result of `read_preamble(src)` if the caller
+                     has already consumed it
+    :return: the number of plaintext bytes that were decrypted
+    """
+    preamble = preamble or read_preamble(src)
+    key = key or settings.DJENGA_ENCRYPTION_KEY
+    derived_key = _get_key_cache().derive(key, preamble.kdf_salt)
+    n_segment = preamble.segment_size + _TAG_SIZE
+    index = n_bytes = 0
+    segment = _read_exactly(src, n_segment)
+    while True:
+        if len(segment) < _TAG_SIZE:
+            raise ValueError('Stream was truncated')
+        following = _read_exactly(src, n_segment)
+        last = not following
+        nonce = _nonce(preamble.nonce_prefix, index, last)
+        cipher = AES.new(derived_key, AES.MODE_GCM, nonce)
+        cipher.update(preamble.raw)
+        data = cipher.decrypt_and_verify(
+            segment[:-_TAG_SIZE], segment[-_TAG_SIZE:])
+        dst.write(data)
+        n_bytes += len(data)
+        if last:
+            return n_bytes
+        index += 1
+        segment = following
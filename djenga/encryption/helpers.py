@@ -1,8 +1,13 @@
 from base64 import b64encode
 from base64 import b64decode
+from collections import OrderedDict
+from threading import Lock
 from threading import local
+from time import monotonic
 import boto3
 import six
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 __all__ = [
@@ -11,6 +16,8 @@ __all__ = [
     'from_b64_str',
     '_get_client',
     '_prefix_alias',
+    '_LruCache',
+    '_setting',
 ]
 
 
@@ -35,11 +42,16 @@ def from_b64_str(value: str):
 
 def _get_client(region: str = None, profile: str = None):
     key = f'{region}-{profile}'
-    client = thread_local.sessions.get(key)
+    # thread_local.sessions only exists on the thread that imported
+    # this module, so create it on first use everywhere else
+    sessions = getattr(thread_local, 'sessions', None)
+    if sessions is None:
+        sessions = thread_local.sessions = {}
+    client = sessions.get(key)
     if not client:
         session = boto3.Session(region_name=region, profile_name=profile)
         client = session.client('kms')
-        thread_local.sessions[key] = client
+        sessions[key] = client
     return client
 
 
@@ -49,3 +61,69 @@ def _prefix_alias(alias: str):
     return alias
 
 
+def _setting(name, default):
+    """
+    reads an optional setting, falling back to the default when
+    running outside of django (e.g., from the command line utilities)
+    """
+    try:
+        return getattr(settings, name, default)
+    except ImproperlyConfigured:
+        return default
+
+
+class _LruCache:
+    """
+    A bounded, thread-safe lru cache whose entries can
+    optionally expire `ttl` seconds after they were added.
+    """
+    def __init__(self, max_size=256, ttl=None):
+        """
+        :param max_size: the maximum number of entries to hold,
+                         0 disables the cache
+        :param ttl: the number of seconds an entry stays valid,
+                    None means entries never expire
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry:
+                if self.ttl is None or monotonic() - entry[1] < self.ttl:
+                    self._values.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._values[key]
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._values[key] = (value, monotonic())
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._values),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+            }
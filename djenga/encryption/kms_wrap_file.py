@@ -0,0 +1,84 @@
+"""
+Encrypts or decrypts files using kms key wrapping.
+
+Usage:
+  kms_wrap_file
+    [--region=<region_name>]
+    [--profile=<profile name>]
+    [--key <key_alias_or_id>]
+    [--decrypt]
+    <input> <output>
+
+Options:
+  -r --region=<region_name>    AWS Region Name
+  -p --profile=<profile_name>  the name of the profile to use to connect to aws
+  -k --key=<key_alias_or_id>   the alias or id of the kms key to use
+  -d --decrypt                 decrypt <input> instead of encrypting it
+
+Use `-` for <input> or <output> to read from stdin or write to stdout.
+"""
+from argparse import ArgumentParser
+import sys
+from .kms_wrapped import encrypt_stream
+from .kms_wrapped import decrypt_stream
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument(
+        '-r', '--region',
+        dest='region',
+        metavar='region_name',
+        help='aws region name, e.g., us-east-2',
+        default=None,
+    )
+    parser.add_argument(
+        '-p', '--profile',
+        dest='profile',
+        metavar='profile_name',
+        help='the name of the profile to use when connecting to aws',
+        default=None,
+    )
+    parser.add_argument(
+        '-k', '--key',
+        dest='key',
+        metavar='<id or alias>',
+        help='the name of the key to use for encryption',
+    )
+    parser.add_argument(
+        '-d', '--decrypt',
+        dest='decrypt',
+        action='store_true',
+        help='decrypt the input instead of encrypting it',
+    )
+    parser.add_argument('input', help='the file to read, or - for stdin')
+    parser.add_argument('output', help='the file to write, or - for stdout')
+    return parser
+
+
+def _open(filename, mode):
+    if filename == '-':
+        stream = sys.stdin if 'r' in mode else sys.stdout
+        return open(stream.fileno(), mode, closefd=False)
+    return open(filename, mode)
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    if not args.decrypt and not args.key:
+        parser.error('--key is required when encrypting')
+    with _open(args.input, 'rb') as src, _open(args.output, 'wb') as dst:
+        if args.decrypt:
+            decrypt_stream(
+                src, dst, region=args.region, profile=args.profile)
+        else:
+            encrypt_stream(
+                src, dst,
+                alias=args.key,
+                profile=args.profile,
+                region=args.region)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,210 @@
+import os
+from threading import Lock
+from time import monotonic
 from .helpers import _as_bytes
 from .helpers import from_b64_str
 from .helpers import _get_client
 from .helpers import _prefix_alias
+from .helpers import _LruCache
+from .helpers import _setting
 from .gcm import encrypt_bytes as gcm_encrypt
 from .gcm import decrypt_bytes as gcm_decrypt
+from .gcm import is_binary
+from .gcm import _gcm_unpack_binary
+from .gcm_stream import encrypt_stream as gcm_encrypt_stream
+from .gcm_stream import decrypt_stream as gcm_decrypt_stream
+from .gcm_stream import read_preamble
 
 
-def encrypt_bytes(
-        plain_text: bytes
-        , alias: str
+class _KmsStats:
+    def __init__(self):
+        self.lock = Lock()
+        self.decrypt_calls = 0
+        self.generate_calls = 0
+        self.generate_calls_avoided = 0
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+_stats = _KmsStats()
+_data_keys = None
+_data_keys_lock = Lock()
+_reusable_keys = {}
+_reusable_keys_lock = Lock()
+
+
+def _get_data_key_cache() -> _LruCache:
+    global _data_keys  # pylint: disable=global-statement
+    if _data_keys is None:
+        with _data_keys_lock:
+            if _data_keys is None:
+                _data_keys = _LruCache(
+                    _setting('DJENGA_KMS_DATA_KEY_CACHE_SIZE', 128),
+                    _setting('DJENGA_KMS_DATA_KEY_CACHE_TTL', 300),
+                )
+    return _data_keys
+
+
+def configure_data_key_cache(max_size=128, ttl=300):
+    """
+    Replaces the cache of unwrapped data keys with an empty one.  By
+    default, the cache is sized from the `DJENGA_KMS_DATA_KEY_CACHE_SIZE`
+    and `DJENGA_KMS_DATA_KEY_CACHE_TTL` settings on first use.
+    :param max_size: the maximum number of data keys to hold,
+                     0 disables the cache
+    :param ttl: the number of seconds a data key stays cached
+    """
+    global _data_keys  # pylint: disable=global-statement
+    with _data_keys_lock:
+        _data_keys = _LruCache(max_size, ttl)
+    with _reusable_keys_lock:
+        _reusable_keys.clear()
+
+
+def kms_cache_info():
+    """
+    :return: a dict with the number of kms `decrypt` and
+             `generate_data_key` calls that were made and avoided,
+             along with the size of the data key cache
+    """
+    info = _get_data_key_cache().info()
+    return {
+        'decrypt_calls': _stats.decrypt_calls,
+        'decrypt_calls_avoided': info['hits'],
+        'generate_calls': _stats.generate_calls,
+        'generate_calls_avoided': _stats.generate_calls_avoided,
+        'size': info['size'],
+        'max_size': info['max_size'],
+        'ttl': info['ttl'],
+    }
+
+
+def _unwrap_data_key(
+        wrapped_data_key: bytes
         , region: str = None
-        , profile: str = None) -> str:
+        , profile: str = None) -> bytes:
+    cache = _get_data_key_cache()
+    data_key = cache.get(wrapped_data_key)
+    if data_key is None:
+        client = _get_client(region, profile)
+        response = client.decrypt(CiphertextBlob=wrapped_data_key)
+        _stats.count('decrypt_calls')
+        data_key = response['Plaintext']
+        cache.put(wrapped_data_key, data_key)
+    return data_key
+
+
+def _generate_data_key(alias, region, profile):
     client = _get_client(region, profile)
-    alias = _prefix_alias(alias)
     response = client.generate_data_key(KeyId=alias, KeySpec='AES_256')
+    _stats.count('generate_calls')
     data_key = response['Plaintext']
     header = response['CiphertextBlob']
-    value = gcm_encrypt(plain_text, data_key, auth_header=header)
+    _get_data_key_cache().put(header, data_key)
+    return data_key, header
+
+
+def _reusable_data_key(alias, region, profile):
+    """
+    Returns a data key that is shared by up to
+    `DJENGA_KMS_DATA_KEY_MAX_MESSAGES` (default 1000) encrypts, for at
+    most `DJENGA_KMS_DATA_KEY_MAX_AGE` seconds (default 300).  Data
+    keys are never shared across processes.
+    """
+    max_messages = _setting('DJENGA_KMS_DATA_KEY_MAX_MESSAGES', 1000)
+    max_age = _setting('DJENGA_KMS_DATA_KEY_MAX_AGE', 300)
+    key = (alias, region, profile, os.getpid())
+    now = monotonic()
+    with _reusable_keys_lock:
+        entry = _reusable_keys.get(key)
+        if entry and entry[2] < max_messages and now - entry[3] < max_age:
+            entry[2] += 1
+            _stats.count('generate_calls_avoided')
+            return entry[0], entry[1]
+    data_key, header = _generate_data_key(alias, region, profile)
+    with _reusable_keys_lock:
+        _reusable_keys[key] = [ data_key, header, 1, now ]
+    return data_key, header
+
+
+def _wrapped_data_key(packed_value) -> bytes:
+    if is_binary(packed_value):
+        return bytes(_gcm_unpack_binary(packed_value)[0])
+    if isinstance(packed_value, (bytes, bytearray, memoryview)):
+        packed_value = bytes(packed_value).decode('utf-8')
+    pieces = packed_value.split('|', 1)
+    return from_b64_str(pieces[0])
+
+
+def encrypt_bytes(  # pylint: disable=redefined-builtin
+        plain_text: bytes
+        , alias: str
+        , region: str = None
+        , profile: str = None
+        , format: str = 'text'
+        , reuse_data_key: bool = False):
+    """
+    :param reuse_data_key: share one data key (and one kdf salt)
+                           across many encrypts instead of asking kms
+                           for a new data key every time
+    """
+    alias = _prefix_alias(alias)
+    if reuse_data_key:
+        data_key, header = _reusable_data_key(alias, region, profile)
+    else:
+        data_key, header = _generate_data_key(alias, region, profile)
+    value = gcm_encrypt(
+        plain_text, data_key, auth_header=header,
+        reuse_salt=reuse_data_key, format=format)
     return value
 
 
 def decrypt_bytes(
-        packed_value: str
+        packed_value
         , region: str = None
         , profile: str = None) -> bytes:
-    pieces = packed_value.split('|', 1)
-    wrapped_data_key = pieces[0]
-    wrapped_data_key = from_b64_str(wrapped_data_key)
-    client = _get_client(region, profile)
-    response = client.decrypt(CiphertextBlob=wrapped_data_key)
-    data_key = response['Plaintext']
+    wrapped_data_key = _wrapped_data_key(packed_value)
+    data_key = _unwrap_data_key(wrapped_data_key, region, profile)
     plain_text = gcm_decrypt(packed_value, data_key)
     return plain_text
 
 
-def encrypt(plain_text, alias, region: str = None, profile: str = None) -> str:
+def encrypt(  # pylint: disable=redefined-builtin
+        plain_text, alias, region: str = None, profile: str = None,
+        format: str = 'text', reuse_data_key: bool = False):
     plain_text = _as_bytes(plain_text)
-    data = encrypt_bytes(plain_text, alias, region, profile)
+    data = encrypt_bytes(
+        plain_text, alias, region, profile, format, reuse_data_key)
     return data
 
 
-def decrypt(packed_value: str, region: str = None, profile: str = None):
+def decrypt(packed_value, region: str = None, profile: str = None):
     data = decrypt_bytes(packed_value, region, profile)
     return data.decode('utf-8')
+
+
+def encrypt_stream(
+        src
+        , dst
+        , alias: str
+        , region: str = None
+        , profile: str = None) -> int:
+    """
+    encrypts `src` into `dst` with a fresh kms data key, storing
+    the wrapped data key in the stream preamble
+    """
+    alias = _prefix_alias(alias)
+    data_key, header = _generate_data_key(alias, region, profile)
+    return gcm_encrypt_stream(src, dst, data_key, auth_header=header)
+
+
+def decrypt_stream(
+        src
+        , dst
+        , region: str = None
+        , profile: str = None) -> int:
+    preamble = read_preamble(src)
+    data_key = _unwrap_data_key(preamble.header, region, profile)
+    return gcm_decrypt_stream(src, dst, data_key, preamble=preamble)
@@ -1,9 +1,19 @@
+from abc import abstractmethod
+from collections import OrderedDict
 import logging
+from random import Random
+import re
+from threading import Lock
+from threading import local
+from time import monotonic
 
 
 __all__ = [
     'ZeepHttpsFilter',
     'CeleryRestoringFilter',
+    'RateLimitFilter',
+    'SamplingFilter',
+    'RuleFilter',
 ]
 
 
@@ -29,3 +39,283 @@ class CeleryRestoringFilter(logging.Filter):
         result &= record.msg.startswith('Restoring')
         result &= record.msg.endswith('unacknowledged message(s)')
         return not result
+
+
+class _Suppressed:
+    __slots__ = ('suppressed', 'summarized', 'tokens', 'refilled')
+
+    def __init__(self, now, tokens=0):
+        self.suppressed = 0
+        self.summarized = now
+        self.tokens = tokens
+        self.refilled = now
+
+
+class _SummaryFilter(logging.Filter):
+    """
+    Counts the records it suppresses per key, and when a record with
+    the same key passes again (at most once every `summary_interval`
+    seconds), first logs a copy of it that says how many similar
+    messages were suppressed, with the count in its `suppressed` field.
+    The summary goes through `logging.getLogger(record.name).handle`,
+    so a filter on a handler also sends it to the logger's other
+    handlers.
+    """
+    def __init__(self, name='', summary_interval=0.0):
+        super().__init__(name)
+        self.summary_interval = summary_interval
+        self.lock = Lock()
+        self.local = local()
+
+    def summarize(self, record, n_suppressed):
+        summary = logging.makeLogRecord(record.__dict__)
+        summary.msg = 'suppressed %d similar messages: %s'
+        summary.args = (n_suppressed, record.msg)
+        summary.exc_info = summary.exc_text = summary.stack_info = None
+        summary.suppressed = n_suppressed
+        self.local.summarizing = True
+        try:
+            logging.getLogger(record.name).handle(summary)
+        finally:
+            self.local.summarizing = False
+
+    def filter(self, record):
+        if getattr(self.local, 'summarizing', False):
+            return True
+        if not super().filter(record):
+            return True
+        allowed, n_suppressed = self.check(record, monotonic())
+        if allowed and n_suppressed:
+            self.summarize(record, n_suppressed)
+        return allowed
+
+    @abstractmethod
+    def check(self, record, now):
+        """
+        :return: (whether to let the record through, the number of
+                 suppressed records to report before it)
+        """
+
+    def take_suppressed(self, entry: _Suppressed, now):
+        """
+        :return: the number of suppressed records to report now
+        """
+        if not entry.suppressed or \
+                now - entry.summarized < self.summary_interval:
+            return 0
+        n_suppressed, entry.suppressed, entry.summarized = \
+            entry.suppressed, 0, now
+        return n_suppressed
+
+
+class RateLimitFilter(_SummaryFilter):
+    """
+    Lets through at most `rate` records per second, with bursts of up
+    to `burst`, for each (logger, level, message template); e.g., a
+    warning logged in a tight loop during an incident.  Only the
+    `max_keys` most recently seen keys are tracked.
+
+        'filters': {
+            'rate_limit': {
+                '()': 'djenga.loggers.RateLimitFilter',
+                'rate': 1, 'burst': 10,
+            },
+        },
+    """
+    def __init__(self, name='', rate=1.0, burst=10, max_keys=10000,
+                 summary_interval=0.0):
+        super().__init__(name, summary_interval)
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    @staticmethod
+    def key(record):
+        """
+        :return: the (logger, level, message template) of the
+                 record, or None when it cannot be hashed
+        """
+        key = (record.name, record.levelno, record.msg)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def check(self, record, now):
+        key = self.key(record)
+        if key is None:
+            return True, 0
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.popitem(last=False)
+                bucket = self.buckets[key] = _Suppressed(now, self.burst)
+            bucket.tokens = min(
+                self.burst,
+                bucket.tokens + (now - bucket.refilled) * self.rate)
+            bucket.refilled = now
+            if bucket.tokens < 1:
+                bucket.suppressed += 1
+                return False, 0
+            bucket.tokens -= 1
+            return True, self.take_suppressed(bucket, now)
+
+
+class SamplingFilter(_SummaryFilter):
+    """
+    Lets through a random sample of the records of each level, e.g.,
+    `rates={'DEBUG': 0.01, 'INFO': 0.1}`; levels without a rate use
+    `default_rate`.  Summaries of the records that were sampled out are
+    logged at most once every `summary_interval` seconds per level.
+    """
+    def __init__(self, name='', rates=None, default_rate=1.0,
+                 summary_interval=60.0, seed=None):
+        super().__init__(name, summary_interval)
+        self.rates = {
+            logging.getLevelName(key) if isinstance(key, str) else key: value
+            for key, value in (rates or {}).items()
+        }
+        self.default_rate = default_rate
+        self.random = Random(seed).random
+        self.counts = {}
+
+    def check(self, record, now):
+        rate = self.rates.get(record.levelno, self.default_rate)
+        if rate >= 1:
+            return True, 0
+        with self.lock:
+            counts = self.counts.get(record.levelno)
+            if counts is None:
+                counts = self.counts[record.levelno] = _Suppressed(now)
+            if self.random() >= rate:
+                counts.suppressed += 1
+                return False, 0
+            return True, self.take_suppressed(counts, now)
+
+
+class RuleFilter(logging.Filter):
+    """
+    Drops records according to a list of declarative rules, each a
+    `(logger prefix, levels, message)` tuple or a dict with those keys:
+
+      * `prefix` is matched with `str.startswith` against the logger
+        name, as the `Ignore*` filters do; `''` matches every logger
+      * `levels` is a collection of level names or numbers, or None
+        for every level
+      * `message` is None, a regular expression that is matched
+        against the start of the message template (`record.msg`), or a
+        callable that takes the record and returns True to drop it
+
+    The prefixes are compiled into a trie, and the rules that apply to
+    each logger name are worked out once and cached, so a record from a
+    logger without rules costs a single dict lookup.  Without `rules`,
+    the filter does the job of `IgnoreDjangoInternals`, `IgnorePisaPdf`,
+    `IgnoreRequests`, `IgnoreCaching`, `ZeepHttpsFilter` and
+    `CeleryRestoringFilter` together:
+
+        'filters': {
+            'ignore': { '()': 'djenga.loggers.RuleFilter' },
+        },
+    """
+    DEFAULT_RULES = (
+        ('django', ('DEBUG',), None),
+        ('xhtml2pdf', ('DEBUG',), None),
+        ('requests', ('INFO', 'DEBUG'), None),
+        ('caching', ('DEBUG',), None),
+        ('zeep.wsdl.bindings', ('WARNING',),
+         r'Forcing soap:address location'),
+        ('celery.redirected', None,
+         r'Restoring.*unacknowledged message\(s\)$'),
+    )
+    #: the maximum number of cached logger names
+    MAX_NAMES = 10000
+
+    def __init__(self, rules=None):
+        super().__init__()
+        self.trie = {}
+        for x in self.DEFAULT_RULES if rules is None else rules:
+            if isinstance(x, dict):
+                x = (x['prefix'], x.get('levels'), x.get('message'))
+            self.add_rule(*x)
+        self.decisions = {}
+
+    @staticmethod
+    def _levels(levels):
+        if levels is None:
+            return None
+        result = set()
+        for x in levels:
+            level = logging.getLevelName(x) if isinstance(x, str) else x
+            if not isinstance(level, int):
+                raise ValueError(f'Unknown logging level {x}')
+            result.add(level)
+        return frozenset(result)
+
+    @staticmethod
+    def _predicate(message):
+        if message is None or callable(message):
+            return message
+        pattern = re.compile(message, re.DOTALL)
+        return lambda record: pattern.match('%s' % (record.msg,))
+
+    def add_rule(self, prefix, levels=None, message=None):
+        node = self.trie
+        for x in prefix:
+            node = node.setdefault(x, {})
+        node.setdefault(None, []).append(
+            (self._levels(levels), self._predicate(message)))
+        self.decisions = {}
+
+    def rules_for(self, name):
+        """
+        :return: the (levels, predicate) of every rule
+                 whose prefix the logger `name` starts with
+        """
+        rules = list(self.trie.get(None, ()))
+        node = self.trie
+        for x in name:
+            node = node.get(x)
+            if node is None:
+                break
+            rules.extend(node.get(None, ()))
+        return rules
+
+    def compile(self, name):
+        """
+        :return: None when no rule applies to the logger `name`,
+                 otherwise a tuple of (the levels that are always
+                 dropped, or None for all of them, and the
+                 (levels, predicate) pairs to check per record)
+        """
+        rules = self.rules_for(name)
+        if not rules:
+            return None
+        checks = tuple(x for x in rules if x[1] is not None)
+        unconditional = [ x[0] for x in rules if x[1] is None ]
+        if any(x is None for x in unconditional):
+            return None, checks
+        return frozenset().union(*unconditional), checks
+
+    def decide(self, name):
+        if len(self.decisions) >= self.MAX_NAMES:
+            self.decisions = {}
+        decision = self.decisions[name] = self.compile(name)
+        return decision
+
+    def filter(self, record):
+        try:
+            decision = self.decisions[record.name]
+        except KeyError:
+            decision = self.decide(record.name)
+        if decision is None:
+            return True
+        dropped, checks = decision
+        if dropped is None or record.levelno in dropped:
+            return False
+        return not any(
+            (levels is None or record.levelno in levels) and predicate(record)
+            for levels, predicate in checks
+        )
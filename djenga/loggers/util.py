@@ -14,6 +14,9 @@ __all__ = [
     'IgnoreCaching',
 ]
 
+# setup the 256-color spectrum
+_ST_COLOR = '\033[38;5;{:d}m'
+
 
 class _Constants:
     LEVEL_COLORS = {
@@ -63,106 +66,101 @@ class _Constants:
         'threadName',
     }
 
+    #: the attributes of every `LogRecord`, plus those that
+    #: `logging.Formatter.format` adds
+    STANDARD = frozenset(
+        set(vars(logging.LogRecord('', 0, '', 0, '', (), None)))
+        | NOT_EXTRA | { 'stack_info', 'asctime' }
+    )
+
+    ST_RESET = '\033[0m'
+    #: the label and text color escapes for each level
+    LEVEL_ESCAPES = {
+        key: (_ST_COLOR.format(label), _ST_COLOR.format(text))
+        for key, (label, text) in LEVEL_COLORS.items()
+    }
+    DEFAULT_ESCAPES = (_ST_COLOR.format(33), _ST_COLOR.format(39))
+
+
+def _format_extra(record):
+    """
+    Log entries can have data sent in the `extra` parameter;
+    e.g., when calling logger.error('msg', extra={''})
+    :return: the extra values of the record, one per line, or ''
+    """
+    values = record.__dict__
+    if values.keys() <= _Constants.STANDARD:
+        return ''
+    mp_extra = {
+        key: value for key, value in values.items()
+        if key not in _Constants.STANDARD and not key.startswith('_')
+    }
+    if not mp_extra:
+        return ''
+    n_max = max(len(key) for key in mp_extra)
+    return u'\n%s' % (u'\n'.join([
+        '    {key:>{n_max}}: {value!r}'.format(
+            key=key,
+            value=value,
+            n_max=n_max
+        ) for key, value in mp_extra.items()
+    ]),)
+
+
+def _plain_message(record):
+    """
+    :return: the message for records that skip the special
+             formatting, or None
+    """
+    # Pass any simple messages from internal things,
+    # like Django's runserver, without special formatting.
+    if record.name == 'werkzeug' and record.levelname == 'INFO':
+        # Highlight POST verbs.
+        if '] "POST ' in record.message:
+            record.message = record.message.replace(
+                '] "POST ',
+                '] "\033[38;5;85mPOST\033[0m ')
+        return record.message
+    # no highlighting for DEBUG messages
+    if record.name.startswith('django.') and record.levelname == 'DEBUG':
+        return record.message
+    return None
+
 
 class ColorFormatter(logging.Formatter):
-    def format(self, record):  # noqa: C901
-        level_colors = _Constants.LEVEL_COLORS.get(record.levelname, (33, 39))
-        # setup the 256-color spectrum
-        st_color = "\033[38;5;{:d}m"
-        st_reset = "\033[0m"
+    def format(self, record):
+        label_color, text_color = _Constants.LEVEL_ESCAPES.get(
+            record.levelname, _Constants.DEFAULT_ESCAPES)
         message = logging.Formatter.format(self, record)
-
-        # Pass any simple messages from internal things,
-        # like Django's runserver, without special formatting.
-        if record.name == 'werkzeug' and record.levelname == 'INFO':
-            # Highlight POST verbs.
-            if '] "POST ' in record.message:
-                record.message = record.message.replace(
-                    '] "POST ',
-                    '] "\033[38;5;85mPOST\033[0m ')
-            return record.message
-        # no highlighting for DEBUG messages
-        if record.name.startswith('django.') and record.levelname == 'DEBUG':
-            return record.message
-
-        # Log entries can have data sent in the `extra` parameter;
-        # e.g., when calling logger.error('msg', extra={''})
-        #  Format extra to include its values in the log print.
-        mp_extra = {}
-        n_max = 0
-        st_extra = ''
-        for key in set(dir(record)) - _Constants.NOT_EXTRA:
-            if key.startswith('_') or key == 'stack_info':
-                continue
-            mp_extra[key] = getattr(record, key)
-            if len(key) > n_max:
-                n_max = len(key)
-        if mp_extra:
-            st_extra = u'\n%s' % (u'\n'.join([
-                '    {key:>{n_max}}: {value!r}'.format(
-                    key=key,
-                    value=value,
-                    n_max=n_max
-                ) for key, value in mp_extra.items()
-            ]),)
-
+        plain = _plain_message(record)
+        if plain is not None:
+            return plain
         return '%s[%s/%s]%s %s%s%s' % (
-            st_color.format(level_colors[0]),
+            label_color,
             record.levelname,
             record.name,
-            st_color.format(level_colors[1]),
+            text_color,
             message,
-            st_extra,
-            st_reset,
+            _format_extra(record),
+            _Constants.ST_RESET,
         )
 
 
 class BriefColorFormatter(logging.Formatter):
-    def format(self, record):  # noqa: C901
-        level_colors = _Constants.LEVEL_COLORS.get(record.levelname, (33, 39))
-        st_color = "\033[38;5;{:d}m"
-        st_reset = "\033[0m"
+    def format(self, record):
+        label_color, text_color = _Constants.LEVEL_ESCAPES.get(
+            record.levelname, _Constants.DEFAULT_ESCAPES)
         message = logging.Formatter.format(self, record)
-
-        # Pass any simple messages from internal things,
-        # like Django's runserver, without special formatting.
-        if record.name == 'werkzeug' and record.levelname == 'INFO':
-            # Highlight POST verbs.
-            if '] "POST ' in record.message:
-                record.message = record.message.replace(
-                    '] "POST ',
-                    '] "\033[38;5;85mPOST\033[0m ')
-            return record.message
-        # no highlighting for DEBUG messages
-        if record.name.startswith('django.') and record.levelname == 'DEBUG':
-            return record.message
-
-        # Log entries can have data sent in the `extra` parameter;
-        # e.g., when calling logger.error('msg', extra={''})
-        #  Format extra to include its values in the log print.
-        mp_extra = {}
-        n_max = 0
-        st_extra = ''
-        for key in set(dir(record)) - _Constants.NOT_EXTRA:
-            if key.startswith('_') or key == 'stack_info':
-                continue
-            mp_extra[key] = getattr(record, key)
-            if len(key) > n_max:
-                n_max = len(key)
-        if mp_extra:
-            st_extra = u'\n%s' % (u'\n'.join([
-                '    {key:>{n_max}}: {value!r}'.format(
-                    key=key,
-                    value=value,
-                    n_max=n_max
-                ) for key, value in mp_extra.items()]),)
+        plain = _plain_message(record)
+        if plain is not None:
+            return plain
         return u'%s[%s]%s %s%s%s' % (
-            st_color.format(level_colors[0]),
+            label_color,
             _Constants.SHORT_LEVELS.get(record.levelname, 'GEN'),
-            st_color.format(level_colors[1]),
+            text_color,
             message,
-            st_extra,
-            st_reset,
+            _format_extra(record),
+            _Constants.ST_RESET,
         )
 
 
@@ -209,3 +207,36 @@ class IgnoreCaching(logging.Filter):
             record.name.startswith('caching') and
             record.levelname == 'DEBUG'
         )
+
+
+def _benchmark(n=100000):
+    """
+    compares the extra field extraction against
+    the `dir()` based one it replaced
+    """
+    from timeit import timeit
+
+    def legacy_extra(record):
+        mp_extra = {}
+        for key in set(dir(record)) - _Constants.NOT_EXTRA:
+            if key.startswith('_') or key == 'stack_info':
+                continue
+            mp_extra[key] = getattr(record, key)
+        return mp_extra
+
+    log = logging.getLogger('djenga.benchmark')
+    formatter = ColorFormatter()
+    for extra in ({}, { 'favorite': 'Olive', 'sheep': 42 }):
+        record = log.makeRecord(
+            log.name, logging.INFO, __file__, 1, 'Hello %s', ('Gwenna',),
+            None, extra=extra)
+        before = timeit(lambda: legacy_extra(record), number=n)
+        after = timeit(lambda: _format_extra(record), number=n)
+        formatted = timeit(lambda: formatter.format(record), number=n)
+        print(f'{len(extra)} extra: dir() {before:.3f}s, '
+              f'__dict__ {after:.3f}s, format {formatted:.3f}s '
+              f'for {n} records')
+
+
+if __name__ == "__main__":
+    _benchmark()
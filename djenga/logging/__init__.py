@@ -1 +1,2 @@
 from .formatters import *
+from .queues import *
@@ -1,13 +1,57 @@
 from datetime import datetime
-import json
 import logging
+from math import modf
 from django.core.serializers.json import DjangoJSONEncoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 
 __all__ = [
     'JsonFormatter',
     'JsonTaskFormatter',
+    'get_json_encoder',
 ]
+_django_encoder = DjangoJSONEncoder()
+_missing = object()
+
+
+def _orjson_dumps(value):
+    # datetimes go through DjangoJSONEncoder, which
+    # renders them differently than orjson does
+    return orjson.dumps(
+        value, default=_django_encoder.default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME).decode('utf-8')
+
+
+def _ujson_dumps(value):
+    return ujson.dumps(
+        value, ensure_ascii=True, escape_forward_slashes=False,
+        default=_django_encoder.default)
+
+
+def get_json_encoder(name='json'):
+    """
+    :param name: `json` for the standard library encoder, `orjson` or
+                 `ujson` when they are installed (falling back to `json`
+                 otherwise), `auto` for the fastest one that is
+                 installed, or a callable that turns a dict into a str
+    :return: a callable that turns a dict into a json str
+    """
+    if callable(name):
+        return name
+    if name not in ('json', 'orjson', 'ujson', 'auto'):
+        raise ValueError(f'Unsupported json encoder {name}')
+    if name in ('orjson', 'auto') and orjson is not None:
+        return _orjson_dumps
+    if name in ('ujson', 'auto') and ujson is not None:
+        return _ujson_dumps
+    return _django_encoder.encode
 
 
 class JsonFormatter(logging.Formatter):
@@ -15,7 +59,48 @@ class JsonFormatter(logging.Formatter):
     This formatter is useful if you want to ship logs to a
     json-based centralized log aggregation platform like ELK.
     n.b., this formatter is very opinionated.
+
+    With the default `json` encoder, records are written by a fast path
+    that caches the timestamp of the current second and the json of
+    the fields that only depend on where a record was logged, and
+    produces exactly the same output as `json.dumps(self.to_dict())`.
+    The `orjson` and `ujson` encoders produce the same json, but
+    without spaces after separators and (for orjson) with non-ascii
+    characters left unescaped.
     """
+    DEFAULT_KEYS = frozenset({
+        'name', 'msg', 'args', 'levelname', 'levelno', 'pathname', 'filename',
+        'module', 'exc_info', 'exc_text', 'stack_info', 'lineno', 'funcName',
+        'created', 'msecs', 'relativeCreated', 'thread', 'threadName',
+        'processName', 'process',
+    })
+    #: the keys that `to_dict` writes before any extra fields
+    DATA_KEYS = frozenset({
+        'timestamp', 'message', 'function', 'path', 'module', 'level',
+        'line_number', 'logger', 'exception_type', 'exception_args',
+    })
+    #: the fields that another formatter (e.g., of a console handler)
+    #: may have added to the record; `to_dict` writes the `message` of
+    #: the record, in place, over its own and `asctime` as any extra
+    FORMATTED_KEYS = frozenset({ 'message', 'asctime' })
+    #: the maximum number of cached call sites
+    MAX_SITES = 10000
+
+    def __init__(self, *args, encoder='json', fast=True, **kwargs):
+        """
+        :param encoder: see `get_json_encoder`
+        :param fast: set to False to always go through `to_dict`
+        """
+        super().__init__(*args, **kwargs)
+        self.encode = get_json_encoder(encoder)
+        self.fast = (
+            fast and self.encode == _django_encoder.encode
+            and type(self).to_dict is JsonFormatter.to_dict
+        )
+        # (second, its iso format), replaced as a whole to be thread-safe
+        self._second = (None, None)
+        self._sites = {}
+
     def format_message(self, record: logging.LogRecord):  # noqa: C901
         s = record.getMessage()
         if record.exc_info:
@@ -34,15 +119,31 @@ class JsonFormatter(logging.Formatter):
         return s
 
     def iso_time(self, record: logging.LogRecord):
-        dt = datetime.utcfromtimestamp(record.created)
-        return dt.isoformat('T')
+        """
+        the same as `datetime.utcfromtimestamp(record.created).isoformat()`,
+        but only formats the date and time once per second
+        """
+        fraction, second = modf(record.created)
+        micros = round(fraction * 1e6)
+        if micros >= 1000000:
+            second, micros = second + 1, micros - 1000000
+        elif micros < 0 or second < 0:
+            return datetime.utcfromtimestamp(record.created).isoformat('T')
+        cached, prefix = self._second
+        if second != cached:
+            prefix = datetime.utcfromtimestamp(second).isoformat('T')
+            self._second = (second, prefix)
+        if micros:
+            return '%s.%06d' % (prefix, micros)
+        return prefix
 
-    DEFAULT_KEYS = {
-        'name', 'msg', 'args', 'levelname', 'levelno', 'pathname', 'filename',
-        'module', 'exc_info', 'exc_text', 'stack_info', 'lineno', 'funcName',
-        'created', 'msecs', 'relativeCreated', 'thread', 'threadName',
-        'processName', 'process',
-    }
+    def additional_fields(self, record: logging.LogRecord):
+        """
+        :return: a dict of fields to add after the extra fields of
+                 the record, or None.  override this rather than
+                 `to_dict` to keep the fast path.
+        """
+        return None
 
     def to_dict(self, record: logging.LogRecord):
         data = {
@@ -66,10 +167,92 @@ class JsonFormatter(logging.Formatter):
         for key, value in record.__dict__.items():
             if key not in JsonFormatter.DEFAULT_KEYS:
                 data[key] = value
+        additional = self.additional_fields(record)
+        if additional:
+            data.update(additional)
         return data
 
+    def site(self, record: logging.LogRecord):
+        """
+        :return: the json of the fields from `function` through `logger`,
+                 which only depend on where the record was logged
+        """
+        key = (
+            record.pathname, record.lineno, record.funcName,
+            record.levelname, record.name, record.module,
+        )
+        fragment = self._sites.get(key)
+        if fragment is None:
+            if len(self._sites) >= self.MAX_SITES:
+                self._sites.clear()
+            fragment = self.encode({
+                'function': record.funcName,
+                'path': record.pathname,
+                'module': record.module,
+                'level': record.levelname,
+                'line_number': record.lineno,
+                'logger': record.name,
+            })[1:-1]
+            self._sites[key] = fragment
+        return fragment
+
+    def fast_format(self, record: logging.LogRecord):
+        """
+        :return: the json of `to_dict(record)`, or None when the record
+                 has fields that the fast path cannot handle
+        """
+        extra = self.extra_fields(record)
+        if extra is None:
+            return None
+        encode = self.encode
+        message = extra.pop('message', _missing)
+        if message is _missing:
+            message = self.format_message(record)
+        pieces = [
+            '{"timestamp": "', self.iso_time(record),
+            '", "message": ', encode(message),
+            ', ', self.site(record),
+        ]
+        if record.exc_info:
+            exception_type = record.exc_info[0]
+            pieces += [
+                ', "exception_type": ',
+                encode(f'{exception_type.__module__}.'
+                       f'{exception_type.__name__}'),
+                ', "exception_args": ',
+                encode(list(record.exc_info[1].args)),
+            ]
+        for key, value in extra.items():
+            pieces += [ ', ', encode(key), ': ', encode(value) ]
+        pieces.append('}')
+        return ''.join(pieces)
+
+    def extra_fields(self, record: logging.LogRecord):
+        """
+        :return: a dict of the fields that `to_dict` adds after its own,
+                 or None when one of them (other than the
+                 `FORMATTED_KEYS`) would replace one of its own
+        """
+        values = record.__dict__
+        extra = {}
+        if not values.keys() <= JsonFormatter.DEFAULT_KEYS:
+            extra = {
+                key: value for key, value in values.items()
+                if key not in JsonFormatter.DEFAULT_KEYS
+            }
+        additional = self.additional_fields(record)
+        if additional:
+            extra.update(additional)
+        if not extra.keys() & self.DATA_KEYS - self.FORMATTED_KEYS:
+            return extra
+        return None
+
     def format(self, record: logging.LogRecord):
-        return json.dumps(self.to_dict(record), cls=DjangoJSONEncoder)
+        if self.fast:
+            result = self.fast_format(record)
+            if result is not None:
+                return result
+        return self.encode(self.to_dict(record))
 
 
 class JsonTaskFormatter(JsonFormatter):
@@ -78,14 +261,15 @@ class JsonTaskFormatter(JsonFormatter):
     json-based centralized log aggregation platform like ELK.
     n.b., this formatter is very opinionated.
     """
-    def to_dict(self, record: logging.LogRecord):
-        data = super(JsonTaskFormatter, self).to_dict(record)
+    def additional_fields(self, record: logging.LogRecord):
         try:
             from celery._state import get_current_task
             task = get_current_task()
             if task and task.request:
-                data['task_id'] = task.request.id
-                data['task_name'] = task.name
+                return {
+                    'task_id': task.request.id,
+                    'task_name': task.name,
+                }
         except ImportError:
             pass
-        return data
+        return None
@@ -0,0 +1,218 @@
+import atexit
+import copy
+import logging
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+import os
+import queue
+from threading import Lock
+
+
+__all__ = [
+    'BatchingQueueListener',
+    'ContextQueueHandler',
+    'QueuePipeline',
+]
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue for a `BatchingQueueListener`, so
+    that formatting and i/o happen on the listener's thread.  What can
+    only be known on the logging thread is captured at emit time: the
+    message is merged with its args and, with `capture_task`, the
+    `task_id` and `task_name` of the current celery task are added to
+    the record (where `JsonFormatter` picks them up).
+
+    When the queue is full, `overflow` decides what happens:
+    `drop_oldest` discards the oldest queued record and `block` waits
+    for room.  `dropped` counts the discarded records.
+    """
+    OVERFLOW_POLICIES = ('drop_oldest', 'block')
+
+    def __init__(self, q, overflow='drop_oldest', capture_task=False):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'Unsupported overflow policy {overflow}')
+        super().__init__(q)
+        self.overflow = overflow
+        self.capture_task = capture_task
+        self.dropped = 0
+        self.drop_lock = Lock()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if self.capture_task:
+            self.add_task_context(record)
+        return record
+
+    @staticmethod
+    def add_task_context(record):
+        try:
+            from celery._state import get_current_task
+        except ImportError:
+            return
+        task = get_current_task()
+        if task and task.request:
+            record.task_id = task.request.id
+            record.task_name = task.name
+
+    def enqueue(self, record):
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                self.drop_oldest()
+
+    def drop_oldest(self):
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            return
+        if hasattr(self.queue, 'task_done'):
+            self.queue.task_done()
+        with self.drop_lock:
+            self.dropped += 1
+
+
+class BatchingQueueListener(QueueListener):
+    """
+    A `QueueListener` that takes up to `batch_size` records off the
+    queue at a time.  Each `StreamHandler` (including `FileHandler`s)
+    writes a whole batch with one `write` and one `flush`; other
+    handlers handle the records one at a time.
+    """
+    def __init__(self, q, *handlers, respect_handler_level=True,
+                 batch_size=100):
+        super().__init__(
+            q, *handlers, respect_handler_level=respect_handler_level)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self):
+        # block rather than fail when the queue is full
+        self.queue.put(self._sentinel)
+
+    def next_batch(self):
+        batch = [ self.dequeue(True) ]
+        while len(batch) < self.batch_size \
+                and batch[-1] is not self._sentinel:
+            try:
+                batch.append(self.dequeue(False))
+            except queue.Empty:
+                break
+        return batch
+
+    def _monitor(self):
+        has_task_done = hasattr(self.queue, 'task_done')
+        while True:
+            batch = self.next_batch()
+            records = [ x for x in batch if x is not self._sentinel ]
+            if records:
+                self.handle_batch(records)
+            if has_task_done:
+                for _ in batch:
+                    self.queue.task_done()
+            if batch[-1] is self._sentinel:
+                return
+
+    def handle_batch(self, records):
+        for handler in self.handlers:
+            if self.respect_handler_level:
+                accepted = [ x for x in records if x.levelno >= handler.level ]
+            else:
+                accepted = records
+            if not accepted:
+                continue
+            if getattr(handler, 'stream', None) is not None:
+                self.write_batch(handler, accepted)
+            else:
+                for x in accepted:
+                    handler.handle(x)
+
+    @staticmethod
+    def format_line(handler: logging.StreamHandler, record):
+        """
+        :return: the formatted line, or None when the record is
+                 filtered out or fails to format
+        """
+        try:
+            if handler.filter(record):
+                return handler.format(record) + handler.terminator
+        except Exception:  # pylint: disable=broad-except
+            handler.handleError(record)
+        return None
+
+    @staticmethod
+    def write_batch(handler: logging.StreamHandler, records):
+        """
+        formats each record on its own, so that a record that fails to
+        format is reported with `handleError` without losing the rest
+        of the batch, then writes the batch with one `write`
+        """
+        format_line = BatchingQueueListener.format_line
+        lines = [ format_line(handler, x) for x in records ]
+        lines = [ x for x in lines if x ]
+        if not lines:
+            return
+        try:
+            with handler.lock:
+                handler.stream.write(''.join(lines))
+                handler.flush()
+        except Exception:  # pylint: disable=broad-except
+            handler.handleError(records[-1])
+
+
+class QueuePipeline:
+    """
+    Moves the handlers of a logger behind a `ContextQueueHandler` and a
+    `BatchingQueueListener`, so that the logging thread only has to put
+    records on a queue.  The listener is restarted with a fresh queue in
+    forked children (e.g., celery's prefork pool) and stopped at exit.
+    """
+    def __init__(self, logger: logging.Logger, queue_size=10000,
+                 overflow='drop_oldest', batch_size=100,
+                 capture_task=False):
+        self.logger = logger
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.handlers = list(logger.handlers)
+        self.handler = ContextQueueHandler(
+            queue.Queue(queue_size), overflow, capture_task)
+        self.listener = None
+        logger.handlers = [ self.handler ]
+        self.start()
+        atexit.register(self.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.after_fork)
+
+    def start(self):
+        self.listener = BatchingQueueListener(
+            self.handler.queue, *self.handlers,
+            batch_size=self.batch_size)
+        self.listener.start()
+
+    def stop(self):
+        """
+        writes any queued records and stops the listener
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def after_fork(self):
+        # the listener thread does not survive the fork, and it may
+        # have held the queue's lock when the fork happened
+        if self.listener is None:
+            return
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.handler.drop_lock = Lock()
+        self.start()
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
@@ -1 +1,7 @@
 from .json_formatters import *  # noqa
+from .gcm_encryption import *  # noqa
+from .gcm_streams import *  # noqa
+from .kms_wrapped_encryption import *  # noqa
+from .config_bunches import *  # noqa
+from .detail_tasks import *  # noqa
+from .loggers import *  # noqa
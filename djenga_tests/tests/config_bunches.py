@@ -0,0 +1,211 @@
+from datetime import date
+import os
+import tempfile
+from threading import Event
+from unittest import mock
+from django.test import TestCase
+from djenga.core import ConfigBunch
+from djenga.core import KmsBunch
+from djenga.core import LazyKmsBunch
+from djenga.core import LazySecret
+
+
+__all__ = [ 'ConfigBunchTest', 'KmsBunchTest', 'LazyKmsBunchTest', ]
+
+
+def write_config(directory, name, text):
+    filename = os.path.join(directory, name)
+    with open(filename, 'w') as f:
+        f.write(text)
+    return filename
+
+
+def mock_decrypt(value, region=None, profile=None):
+    if value.startswith('bad'):
+        raise ValueError(value)
+    return value.replace('|', '')
+
+
+class ConfigBunchTest(TestCase):
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache_dir = os.path.join(directory, 'cache')
+            filename = write_config(
+                directory, 'config.yml', 'dbs.default.port: 3306')
+            missing = os.path.join(directory, 'missing.yml')
+            load_file = ConfigBunch.load_file
+            with mock.patch.object(
+                    ConfigBunch, 'load_file', autospec=True,
+                    side_effect=load_file) as load_file:
+                config = ConfigBunch(filename, missing, cache_dir=cache_dir)
+                self.assertEqual(config.dbs.default.port, 3306)
+                self.assertEqual(load_file.call_count, 1)
+                config = ConfigBunch(filename, missing, cache_dir=cache_dir)
+                self.assertEqual(config.dbs.default.port, 3306)
+                self.assertEqual(load_file.call_count, 1)
+                write_config(directory, 'config.yml', 'dbs.default.port: 3307')
+                config = ConfigBunch(filename, missing, cache_dir=cache_dir)
+                self.assertEqual(config.dbs.default.port, 3307)
+                self.assertEqual(load_file.call_count, 2)
+                write_config(directory, 'config.yml', 'started: 2020-01-02')
+                ConfigBunch(filename, cache_dir=cache_dir)
+                config = ConfigBunch(filename, cache_dir=cache_dir)
+                self.assertEqual(config.started, date(2020, 1, 2))
+                self.assertEqual(load_file.call_count, 3)
+                os.chmod(cache_dir, 0o777)
+                ConfigBunch(filename, cache_dir=cache_dir)
+                self.assertEqual(load_file.call_count, 4)
+
+    def test_load_file(self):
+        class UpperBunch(ConfigBunch):
+            def load_file(self, f):
+                return { 'name': f.read().strip().upper() }
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = write_config(directory, 'name.txt', 'olive')
+            self.assertEqual(UpperBunch(filename).name, 'OLIVE')
+
+    def test_index(self):
+        config = ConfigBunch()
+        config.assimilate_values({
+            'dbs.default.host': 'localhost',
+            'dbs.default.port': 3306,
+        })
+        self.assertEqual(config.get('dbs.default.port'), 3306)
+        self.assertIs(config.get('dbs.default'), config.dbs.default)
+        self.assertEqual(config.dbs.get('default.host'), 'localhost')
+        self.assertEqual(config.get('dbs.default.user', 'x'), 'x')
+        config.dbs.default.host = 'remote'
+        self.assertEqual(config['dbs.default.host'], 'remote')
+        config.dbs['default.port'] = 3307
+        self.assertEqual(config.get('dbs.default.port'), 3307)
+        config.dbs.replica = ConfigBunch()
+        config.dbs.replica.host = 'replica'
+        self.assertEqual(config.get('dbs.replica.host'), 'replica')
+        del config.dbs.replica
+        self.assertIsNone(config.get('dbs.replica.host'))
+        default = config.dbs.default
+        config['dbs.default'] = 'gone'
+        default.host = 'stale'
+        self.assertIsNone(config.get('dbs.default.host'))
+        with self.assertRaises(KeyError):
+            config['dbs.default.host']  # pylint: disable=W0104
+        config.assimilate_values({ '_index': 'mine', 'dbs._private': 1 })
+        config.freeze()
+        self.assertEqual(config['dbs.default'], 'gone')
+        self.assertEqual(config.get('_index'), 'mine')
+        self.assertEqual(config.get('dbs._private'), 1)
+        self.assertEqual(config.dbs._private, 1)  # pylint: disable=W0212
+        with self.assertRaises(TypeError):
+            config['dbs.replica'] = 'new'
+        with self.assertRaises(TypeError):
+            config.dbs.replica = 'new'
+
+    def test_reload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = write_config(directory, 'config.yml', '\n'.join([
+                'dbs.default.host: localhost',
+                'dbs.default.port: 3306',
+            ]))
+            config = ConfigBunch(filename)
+            default = config.dbs.default
+            changed = Event()
+            seen = []
+
+            def on_change(changes):
+                seen.append(changes)
+                changed.set()
+
+            config.subscribe(on_change, prefix='dbs.default')
+            watcher = config.watch(interval=0.05, use_inotify=False)
+            try:
+                write_config(directory, 'config.yml', '\n'.join([
+                    'dbs.default.host: localhost',
+                    'dbs.default.port: 3307',
+                    'dbs.default.user: olive',
+                ]))
+                self.assertTrue(changed.wait(5))
+            finally:
+                config.unwatch()
+            self.assertFalse(watcher.is_alive())
+        self.assertEqual(seen[0], {
+            'dbs.default.port': (3306, 3307),
+            'dbs.default.user': (None, 'olive'),
+        })
+        self.assertEqual(config.get('dbs.default.port'), 3307)
+        self.assertEqual(config.dbs.default.user, 'olive')
+        self.assertEqual(default.port, 3306)
+
+
+class KmsBunchTest(TestCase):
+    @mock.patch('djenga.encryption.kms_wrapped.decrypt',
+                side_effect=mock_decrypt)
+    def test_decrypt(self, decrypt):
+        with tempfile.TemporaryDirectory() as directory:
+            first = write_config(directory, 'first.yml', '\n'.join([
+                'dbs.default.password: a|b|c|d|e',
+                'dbs.default.port: 3306',
+                'dbs.replica.password: a|b|c|d|e',
+                'dbs.names: [ x|y|z|w|v, plain ]',
+            ]))
+            second = write_config(directory, 'second.yml', '\n'.join([
+                'broken: bad|b|c|d|e',
+            ]))
+            config = KmsBunch(first, second, max_workers=4)
+        self.assertEqual(config.dbs.default.password, 'abcde')
+        self.assertEqual(config.dbs.replica.password, 'abcde')
+        self.assertEqual(config.dbs.default.port, 3306)
+        self.assertEqual(config.dbs.names, [ 'xyzwv', 'plain' ])
+        self.assertEqual(config.broken, 'bad|b|c|d|e')
+        self.assertEqual(decrypt.call_count, 3)
+
+    @mock.patch('djenga.encryption.kms_wrapped.decrypt',
+                side_effect=mock_decrypt)
+    def test_reload(self, _):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = write_config(
+                directory, 'kms.yml', 'dbs.default.password: a|b|c|d|e')
+            config = KmsBunch(filename, region='us-east-1')
+            self.assertEqual(config.reload(), {})
+            write_config(
+                directory, 'kms.yml', 'dbs.default.password: v|w|x|y|z')
+            changes = config.reload()
+        self.assertEqual(changes, {
+            'dbs.default.password': ('abcde', 'vwxyz'),
+        })
+        self.assertEqual(config.get('dbs.default.password'), 'vwxyz')
+        self.assertEqual(config.region, 'us-east-1')
+
+
+class LazyKmsBunchTest(TestCase):
+    def test_lazy_secret(self):
+        decrypt = mock.Mock(side_effect=lambda x: x.upper())
+        secret = LazySecret('a|b|c|d|e', decrypt)
+        self.assertEqual(secret.get(), 'A|B|C|D|E')
+        self.assertEqual(secret.get(), 'A|B|C|D|E')
+        self.assertEqual(decrypt.call_count, 1)
+        secret.value = 'v|w|x|y|z'
+        self.assertEqual(secret.get(), 'V|W|X|Y|Z')
+        self.assertEqual(decrypt.call_count, 2)
+        secret = LazySecret('a|b|c|d|e', decrypt, ttl=0)
+        secret.get()
+        secret.get()
+        self.assertEqual(decrypt.call_count, 4)
+
+    @mock.patch('djenga.encryption.kms_wrapped.decrypt',
+                side_effect=mock_decrypt)
+    def test_prefetch(self, decrypt):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = write_config(directory, 'lazy.yml', '\n'.join([
+                'dbs.default.password: a|b|c|d|e',
+                'dbs.replica.password: v|w|x|y|z',
+                'api.keys: [ k|l|m|n|o ]',
+            ]))
+            config = LazyKmsBunch(filename)
+        self.assertIsInstance(config.dbs.default.password, LazySecret)
+        config.prefetch([ 'dbs' ]).join()
+        self.assertEqual(decrypt.call_count, 2)
+        self.assertTrue(config.dbs.replica.password.decrypted)
+        self.assertFalse(config.api.keys[0].decrypted)
+        self.assertEqual(config.dbs.default.password.get(), 'abcde')
+        self.assertEqual(decrypt.call_count, 2)
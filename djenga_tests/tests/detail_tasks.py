@@ -0,0 +1,431 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import pickle
+import tempfile
+from time import sleep
+from unittest import mock
+from celery import states
+from celery import Celery
+from celery.app.trace import build_tracer
+from django.test import TestCase
+import fakeredis
+from djenga.celery.backends import RedisDetailBackend
+from djenga.celery.flusher import detail_flush_stats
+from djenga.celery.groups import DetailGroup
+from djenga.celery.results import AsyncDetailedResult
+from djenga.celery.results import DetailedResultSet
+from djenga.celery.results import clear_details_cache
+from djenga.celery.tasks import DetailTask
+from djenga.celery.tasks import TaskDetail
+from djenga.celery.timings import disable_step_timings
+from djenga.celery.timings import enable_step_timings
+from djenga.celery.utils import auto_step
+from djenga.celery.utils import substep
+from djenga.celery.utils import update_progress
+
+
+__all__ = [
+    'DetailTaskTest', 'StepTimingsTest',
+    'RedisDetailBackendTest', 'DetailGroupTest',
+]
+app = Celery('djenga_detail_tests', set_as_current=False)
+
+
+def fake_backend(**kwargs):
+    backend = RedisDetailBackend(
+        app=app, url='redis://localhost:6379/15', **kwargs)
+    backend.__dict__['client'] = fakeredis.FakeStrictRedis()
+    return backend
+
+
+@app.task(bind=True, base=DetailTask, details_min_interval=60,
+          details_max_pending=50)
+def count_sheep(self, n):
+    self.start_step(1, 'count sheep')
+    for x in range(n):
+        self.update_step('sheep %d', x)
+    self.end_step()
+    self.start_step(2, 'sleep')
+    return n
+
+
+@app.task(bind=True, base=DetailTask, details_min_interval=60)
+def count_geese(self, n):
+    self.start_step(1, 'count geese')
+
+    def count(x):
+        for y in range(n):
+            self.update_step('goose %d.%d', x, y)
+            sleep(0.001)
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(self.bind_detail(count), range(4)))
+    return n
+
+
+class Minion:
+    """
+    the signature of a child task that is done as soon as it is sent
+    """
+    def __init__(self, n):
+        self.n = n
+
+    def apply_async(self):
+        task_id = 'minion-%d' % (self.n,)
+        steal_all_moons.backend.store_result(task_id, self.n, states.SUCCESS)
+        return mock.Mock(id=task_id)
+
+
+@app.task(bind=True, base=DetailTask)
+def steal_all_moons(self, n, group_state=None):
+    self.start_step(1, 'steal the moons')
+    group = DetailGroup(
+        self, [ Minion(x) for x in range(n) ], max_in_flight=2,
+        state=group_state)
+    group.poll()
+    if not group.done:
+        group.retry(countdown=0)
+    self.end_step()
+    return len(group.task_ids)
+
+
+@auto_step(key=1)
+def count_lambs(self, n):
+    for x in range(n):
+        yield x
+
+
+@auto_step(key=2)
+async def count_cows(self, n):
+    await asyncio.sleep(0)
+    return n
+
+
+def count_goats(n):
+    return n
+
+
+@app.task(bind=True, base=DetailTask,
+          steps=[ (1, 'lambs'), (2, 'cows'), (3, 'goats') ])
+def count_animals(self, n):
+    self.end_step()
+    total = sum(count_lambs(self, n))
+    total += asyncio.run(count_cows(self, n))
+    self.start_step(3)
+    goats = self.bind_detail(substep(self, count_goats))
+    with ThreadPoolExecutor(4) as pool:
+        total += sum(pool.map(goats, range(n)))
+    self.end_step()
+    return total
+
+
+@app.task(bind=True, base=DetailTask)
+def count_flocks(self, n, executor):
+    self.start_step(1, 'count flocks')
+    results = list(self.parallel_map(
+        sum, range(n), chunk_size=3, workers=2,
+        executor=executor, progress_interval=0))
+    self.end_step()
+    return results
+
+
+class ShortDetail(TaskDetail):
+    __slots__ = ()
+    max_details = 3
+
+
+class DetailTaskTest(TestCase):
+    def test_coalesced_writes(self):
+        backend = mock.Mock()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            before = detail_flush_stats()
+            result = count_sheep.apply(args=(200,))
+            self.assertEqual(result.get(), 200)
+        after = detail_flush_stats()
+        writes = backend.store_result.call_count
+        self.assertLessEqual(writes, 6)
+        self.assertEqual(writes, after['writes'] - before['writes'])
+        self.assertGreater(after['coalesced'] - before['coalesced'], 190)
+        self.assertEqual(after['pending'], 0)
+
+    def test_threaded_writes(self):
+        # updates from bound threads share the task's flush interval
+        backend = mock.Mock()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            count_geese.apply(args=(50,))
+        self.assertLessEqual(backend.store_result.call_count, 2)
+
+    def test_steps(self):
+        backend = mock.Mock()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            result = count_animals.apply(args=(4,))
+            self.assertEqual(result.get(), 16)
+        details = backend.store_result.call_args[1]['details']
+        lambs, cows, goats = [ x.to_json() for x in details.values() ]
+        self.assertEqual(lambs['details'], [ 'in progress', 'done' ])
+        self.assertTrue(lambs['done'] and cows['done'] and goats['done'])
+        self.assertEqual(len(goats['details']), 10)
+        self.assertEqual(
+            sum(x.startswith('count_goats done in') for x in goats['details']),
+            4)
+
+    def test_parallel_map(self):
+        backend = mock.Mock()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            for executor in ('thread', 'process'):
+                result = count_flocks.apply(args=(10, executor))
+                self.assertEqual(result.get(), [ 3, 12, 21, 9 ])
+        details = backend.store_result.call_args[1]['details']
+        messages = details[1].to_json()['details']
+        self.assertEqual(len(messages), 6)
+        self.assertTrue(messages[1].startswith('1/4 chunks, ETA'))
+        self.assertEqual(messages[-2], '4/4 chunks')
+        for kwargs in ({ 'chunk_size': 0 }, { 'executor': 'fiber' }):
+            with self.assertRaises(ValueError):
+                count_flocks.parallel_map(sum, range(10), **kwargs)
+
+    def test_task_detail(self):
+        detail = ShortDetail(1, 'count sheep')
+        detail.start_time()
+        for x in range(5):
+            detail.add_detail('sheep %d' % x)
+        self.assertEqual(detail.count, 5)
+        self.assertEqual(detail.details_since(3), [ 'sheep 3', 'sheep 4' ])
+        self.assertEqual(len(detail.details_since(0)), 3)
+        data = detail.to_json()
+        self.assertIs(data, detail.to_json())
+        self.assertEqual(data['details'], [ 'sheep 2', 'sheep 3', 'sheep 4' ])
+        detail.end_time()
+        self.assertIsNot(data, detail.to_json())
+        self.assertTrue(detail.to_json()['done'])
+        self.assertIsInstance(detail.millis, int)
+        copy = pickle.loads(pickle.dumps(detail))
+        self.assertEqual(copy.to_json(), detail.to_json())
+
+
+@app.task(bind=True, base=DetailTask,
+          steps=[ (1, 'fly to the moon'), (2, 'shrink the moon') ])
+def steal_the_moon(self, n):
+    self.start_step(1)
+    for x in range(n):
+        self.update_step('mile %d', x)
+    self.end_step()
+    self.start_step(2)
+    return n
+
+
+@app.task(bind=True, base=DetailTask, progress_history=3)
+def fire_the_freeze_ray(self, n):
+    for x in range(n):
+        update_progress(self, 'shot %d', x, shots=x + 1)
+    return n
+
+
+class StepTimingsTest(TestCase):
+    def tearDown(self):
+        disable_step_timings()
+
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'steps-{pid}.prom')
+            timings = enable_step_timings(filename, interval=3600)
+            with mock.patch.object(DetailTask, 'backend', mock.Mock()):
+                steal_the_moon.apply(args=(1,))
+            for x in range(1, 101):
+                timings.record('gru', 'plan', x)
+            report = timings.report()
+            self.assertEqual(report[('gru', 'plan')]['count'], 100)
+            self.assertEqual(report[('gru', 'plan')]['max'], 0.1)
+            self.assertAlmostEqual(report[('gru', 'plan')]['p50'], 0.05)
+            self.assertGreater(report[('gru', 'plan')]['p99'], 0.095)
+            self.assertIn((steal_the_moon.name, '1'), report)
+            timings.flush()
+            path = filename.format(pid=os.getpid())
+            with open(path) as f:
+                text = f.read()
+            disable_step_timings()
+            self.assertFalse(os.path.exists(path))
+        labels = 'task="gru",step="plan",pid="%d"' % (os.getpid(),)
+        self.assertIn(
+            'djenga_step_duration_seconds_count{%s} 100' % (labels,), text)
+        self.assertIn(
+            'djenga_step_duration_seconds_bucket{%s,le="0.1"} 100'
+            % (labels,), text)
+        self.assertNotIn('quantile', text)
+
+
+class RedisDetailBackendTest(TestCase):
+    def test_deltas(self):
+        backend = fake_backend()
+        detail = TaskDetail(1, 'fly to the moon')
+        detail.add_detail('in progress')
+        backend._store_details('gru', [ detail ])
+        detail.add_detail('mile 1')
+        backend._store_details('gru', [ detail ])
+        backend._store_details('gru', [ detail ])
+        messages = backend.client.lrange(backend.details_key('gru', 0), 0, -1)
+        self.assertEqual(
+            [ backend.decode(x) for x in messages ],
+            [ 'in progress', 'mile 1' ])
+
+    def test_details(self):
+        backend = fake_backend()
+        backend.detail_history_max = 5
+        with mock.patch.object(DetailTask, 'backend', backend):
+            result = steal_the_moon.apply(args=(10,))
+        details = AsyncDetailedResult(result.id, backend=backend).details()
+        self.assertEqual([ x['key'] for x in details ], [ 1, 2 ])
+        self.assertEqual(details[0]['details'], [
+            'mile 6', 'mile 7', 'mile 8', 'mile 9', 'done' ])
+        self.assertEqual(details[0]['latest'], 'done')
+        self.assertTrue(details[0]['done'])
+        self.assertEqual(details[1]['details'], [ 'in progress' ])
+        self.assertFalse(details[1]['done'])
+        backend.forget(result.id)
+        self.assertEqual(backend.client.keys(), [])
+
+    def test_worker_details(self):
+        # unlike apply(), a worker stores the final state of the task
+        backend = fake_backend()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            for task in (steal_the_moon, count_sheep):
+                tracer = build_tracer(task.name, task, app=app, eager=False)
+                tracer('minion-%s' % (task.name,), (3,), {})
+                result = AsyncDetailedResult(
+                    'minion-%s' % (task.name,), backend=backend)
+                self.assertEqual(result.state, states.SUCCESS)
+                self.assertEqual(
+                    [ x['key'] for x in result.details() ], [ 1, 2 ])
+
+    def test_rerun(self):
+        # a retry or a redelivery runs the same task id again
+        backend = fake_backend()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            for _ in range(2):
+                steal_the_moon.apply(args=(2,), task_id='gru')
+        details = AsyncDetailedResult('gru', backend=backend).details()
+        self.assertEqual(details[0]['details'], [
+            'in progress', 'mile 0', 'mile 1', 'done' ])
+        self.assertEqual(details[1]['details'], [ 'in progress' ])
+
+    def test_details_many(self):
+        backend = fake_backend()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            ids = [ steal_the_moon.apply(args=(x,)).id for x in (1, 3) ]
+        clear_details_cache()
+        results = DetailedResultSet(ids + [ 'nope' ], backend=backend,
+                                    cache_ttl=60)
+        with mock.patch.object(backend, 'mget', wraps=backend.mget) as mget:
+            details = results.details()
+            self.assertEqual(details, results.details())
+        self.assertEqual(mget.call_count, 1)
+        self.assertEqual(list(details), ids + [ 'nope' ])
+        for x in ids:
+            self.assertEqual(
+                details[x], AsyncDetailedResult(x, backend=backend).details())
+        self.assertEqual(len(details[ids[1]][0]['details']), 5)
+        self.assertEqual(details['nope'], [])
+
+    def test_events(self):
+        backend = fake_backend()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            task_id = steal_the_moon.apply(args=(2,)).id
+        result = AsyncDetailedResult(task_id, backend=backend)
+        events = list(result.iter_events(timeout=0.1))
+        summary = [ (x['event'], x['step'], x['message']) for x in events ]
+        self.assertEqual(summary, [
+            ('start', 1, 'fly to the moon'),
+            ('update', 1, 'in progress'),
+            ('update', 1, 'mile 0'),
+            ('update', 1, 'mile 1'),
+            ('update', 1, 'done'),
+            ('end', 1, 'done'),
+            ('start', 2, 'shrink the moon'),
+            ('update', 2, 'in progress'),
+        ])
+        backend.store_result(task_id, 2, states.SUCCESS)
+
+        async def collect():
+            return [ x async for x in result.aiter_events(events[-1]['id']) ]
+        events = asyncio.run(collect())
+        self.assertEqual([ x['event'] for x in events ], [ 'finish' ])
+        self.assertEqual(events[0]['state'], states.SUCCESS)
+
+    def test_event_times(self):
+        # coalesced writes still report when each change happened
+        detail = TaskDetail(1, 'fly to the moon')
+        with mock.patch('djenga.celery.tasks.time',
+                        side_effect=[ 10.0, 11.0, 12.0, 13.0 ]):
+            detail.start_time()
+            detail.add_detail('in progress')
+            detail.add_detail('mile 0')
+            detail.end_time()
+        events = RedisDetailBackend._step_events(detail)
+        self.assertEqual(
+            [ (x['event'], x['time']) for x in events ],
+            [ ('start', 10.0), ('update', 11.0),
+              ('update', 12.0), ('end', 13.0) ])
+
+    def test_progress(self):
+        backend = fake_backend()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            request_id = fire_the_freeze_ray.apply(args=(10,)).id
+        result = AsyncDetailedResult(request_id, backend=backend)
+        self.assertEqual(result.info['progress'], 'shot 7\nshot 8\nshot 9')
+        self.assertEqual(result.info['progress_count'], 10)
+        self.assertEqual(
+            result.progress(2, 3), [ 'shot 2', 'shot 3', 'shot 4' ])
+        self.assertEqual(len(result.progress()), 10)
+
+
+class DetailGroupTest(TestCase):
+    def test_poll(self):
+        task = mock.Mock(backend=fake_backend())
+        task.request.current_detail = None
+        signatures = [ mock.Mock() for _ in range(5) ]
+        for n, x in enumerate(signatures):
+            x.apply_async.return_value.id = 'minion-%d' % (n,)
+        group = DetailGroup(task, signatures, max_in_flight=2)
+        self.assertEqual(group.poll().dispatched, 2)
+        task.backend.store_result('minion-0', 1, states.SUCCESS)
+        steps = OrderedDict([ (1, TaskDetail(1)), (2, TaskDetail(2)) ])
+        steps[1].end_time()
+        task.backend.store_result(
+            'minion-1', None, states.STARTED, details=steps)
+        progress = group.poll()
+        self.assertEqual(progress.dispatched, 3)
+        self.assertEqual(progress.succeeded, 1)
+        self.assertEqual(progress.running, 2)
+        self.assertAlmostEqual(progress.fraction, 0.3)
+        self.assertIsNotNone(progress.eta)
+        self.assertFalse(group.done)
+        group.cancel()
+        task.app.control.revoke.assert_called_once_with(
+            [ 'minion-1', 'minion-2' ], terminate=False)
+        state = json.loads(json.dumps(group.state()))
+        group = DetailGroup(task, signatures, max_in_flight=2, state=state)
+        self.assertTrue(group.done)
+        self.assertEqual(group.poll().dispatched, 3)
+
+    def test_retry(self):
+        backend = fake_backend()
+        with mock.patch.object(DetailTask, 'backend', backend):
+            result = steal_all_moons.apply(args=(5,), task_id='gru')
+        self.assertEqual(result.get(), 5)
+        details = AsyncDetailedResult('gru', backend=backend).details()
+        self.assertEqual(len(details), 1)
+        messages = details[0]['details']
+        self.assertEqual(messages[0], 'in progress')
+        self.assertEqual(
+            [ x.split(',')[0] for x in messages[1:-1] ], [
+                '0/5 children done', '2/5 children done',
+                '4/5 children done', '5/5 children done',
+            ])
+        self.assertEqual(messages[-1], 'done')
+        events = AsyncDetailedResult(
+            'gru', backend=backend).iter_events(timeout=0.1)
+        self.assertEqual(
+            [ x['event'] for x in events if x['event'] != 'update' ],
+            [ 'start', 'end' ])
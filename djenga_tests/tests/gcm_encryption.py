@@ -0,0 +1,69 @@
+import uuid
+from django.test import TestCase
+from djenga.encryption import gcm
+
+
+__all__ = [ 'GcmEncryptionTest', ]
+
+
+class GcmEncryptionTest(TestCase):
+    def setUp(self):
+        gcm.configure_key_cache(max_size=4)
+
+    def test_round_trip(self):
+        key = uuid.uuid4().bytes
+        value = gcm.encrypt('Hello, Gwenna!', key)
+        self.assertEqual(gcm.decrypt(value, key), 'Hello, Gwenna!')
+        self.assertEqual(gcm.decrypt(gcm.encrypt('Olive')), 'Olive')
+
+    def test_key_cache(self):
+        key = uuid.uuid4().bytes
+        value = gcm.encrypt('Hello, Olive!', key)
+        for _ in range(3):
+            self.assertEqual(gcm.decrypt(value, key), 'Hello, Olive!')
+        info = gcm.key_cache_info()
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['hits'], 2)
+        for _ in range(6):
+            gcm.decrypt(gcm.encrypt('x', key), key)
+        self.assertEqual(gcm.key_cache_info()['size'], 4)
+
+    def test_reuse_salt(self):
+        key = uuid.uuid4().bytes
+        first = gcm.encrypt('one', key, reuse_salt=True)
+        second = gcm.encrypt('two', key, reuse_salt=True)
+        self.assertEqual(first.split('|')[-1], second.split('|')[-1])
+        self.assertNotEqual(first.split('|')[3], second.split('|')[3])
+        self.assertEqual(gcm.key_cache_info()['misses'], 1)
+        self.assertEqual(gcm.decrypt(first, key), 'one')
+        self.assertEqual(gcm.decrypt(second, key), 'two')
+        self.assertEqual(gcm.key_cache_info()['misses'], 1)
+
+    def test_many(self):
+        key = uuid.uuid4().bytes
+        values = [ f'value {x}' for x in range(10) ]
+        packed = gcm.encrypt_many(values, key, chunk_size=4)
+        self.assertEqual(len({ x.split('|')[-1] for x in packed }), 3)
+        packed[3] = 'not|a|valid|packed|value'
+        results = gcm.decrypt_many(packed, key, workers=2, chunk_size=4)
+        self.assertIsInstance(results[3], Exception)
+        for i, x in enumerate(results):
+            if i != 3:
+                self.assertEqual(x, values[i].encode('utf-8'))
+
+    def test_binary_format(self):
+        key = uuid.uuid4().bytes
+        text = gcm.encrypt('Hello, Penny!', key)
+        value = gcm.encrypt('Hello, Penny!', key, format='binary')
+        self.assertIsInstance(value, bytes)
+        self.assertTrue(gcm.is_binary(value))
+        self.assertFalse(gcm.is_binary(text))
+        self.assertLess(len(value), len(text))
+        self.assertEqual(gcm.decrypt(value, key), 'Hello, Penny!')
+        self.assertEqual(gcm.decrypt(text.encode('utf-8'), key),
+                         'Hello, Penny!')
+        with self.assertRaises(ValueError):
+            gcm.decrypt(value[:-1], key)
+        for fn in (gcm.encrypt, gcm.encrypt_many):
+            with self.assertRaises(ValueError):
+                fn([ 'Hello, Penny!' ], key, format='json')
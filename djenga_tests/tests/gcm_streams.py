@@ -0,0 +1,43 @@
+from io import BytesIO
+import uuid
+from django.test import TestCase
+from djenga.encryption import gcm_stream
+
+
+__all__ = [ 'GcmStreamTest', ]
+
+
+class GcmStreamTest(TestCase):
+    def round_trip(self, data, key):
+        encrypted = BytesIO()
+        n = gcm_stream.encrypt_stream(
+            BytesIO(data), encrypted, key, segment_size=16)
+        self.assertEqual(n, len(data))
+        decrypted = BytesIO()
+        encrypted.seek(0)
+        gcm_stream.decrypt_stream(encrypted, decrypted, key)
+        self.assertEqual(decrypted.getvalue(), data)
+        return encrypted.getvalue()
+
+    def test_round_trip(self):
+        key = uuid.uuid4().bytes
+        for n in (0, 1, 16, 17, 100):
+            self.round_trip(bytes(range(n)), key)
+
+    def test_tampering(self):
+        key = uuid.uuid4().bytes
+        encrypted = self.round_trip(b'x' * 64, key)
+        corrupted = bytearray(encrypted)
+        corrupted[-40] ^= 1
+        truncated = encrypted[:-32]
+        for value in (bytes(corrupted), truncated):
+            with self.assertRaises(ValueError):
+                gcm_stream.decrypt_stream(BytesIO(value), BytesIO(), key)
+
+    def test_segment_size(self):
+        key = uuid.uuid4().bytes
+        for n in (0, -1, 2 ** 32):
+            with self.assertRaises(ValueError):
+                gcm_stream.encrypt_stream(
+                    BytesIO(b'important data'), BytesIO(), key,
+                    segment_size=n)
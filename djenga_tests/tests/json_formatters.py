@@ -1,11 +1,23 @@
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
+from io import StringIO
 import json
 import logging
+import queue
+import sys
 from unittest import mock
+from django.core.serializers.json import DjangoJSONEncoder
 from django.test import TestCase
+from djenga.celery.utils import _pipelines
+from djenga.celery.utils import _queue_logger
 from djenga.logging.formatters import JsonFormatter, JsonTaskFormatter
+from djenga.logging.queues import BatchingQueueListener
+from djenga.logging.queues import ContextQueueHandler
+from djenga.logging.queues import QueuePipeline
 
 
-__all__ = [ 'JsonFormatterTest', ]
+__all__ = [ 'JsonFormatterTest', 'QueuePipelineTest', ]
 log = logging.getLogger(__name__)
 
 
@@ -51,3 +63,115 @@ class JsonFormatterTest(TestCase):
             data = json.loads(data)
             self.assertEqual(data['task_id'], 'olive')
             self.assertEqual(data['task_name'], 'gwenna')
+
+    def test_fast_path(self):
+        formatter = JsonFormatter()
+        self.assertTrue(formatter.fast)
+        extras = [
+            {},
+            { 'favorite': 'Olivé', 'when': datetime(2020, 1, 2, 3, 4, 5, 6) },
+            { 'amount': Decimal('1.50'), 'path': 'overridden' },
+        ]
+        for created in (1500000000.0, 1500000000.9999997, 1500000001.25):
+            for extra in extras:
+                try:
+                    raise ValueError('fast', 1)
+                except ValueError:
+                    record = log.makeRecord(
+                        log.name, logging.ERROR, __file__, 10, 'Hi, %s!',
+                        ('Gwenna',), sys.exc_info(), extra=extra)
+                record.created = created
+                expected = json.dumps(
+                    formatter.to_dict(record), cls=DjangoJSONEncoder)
+                self.assertEqual(formatter.format(record), expected)
+
+    def test_preformatted(self):
+        # e.g., a console handler formatted the record first
+        formatter = JsonFormatter()
+        try:
+            raise ValueError('fast')
+        except ValueError:
+            record = log.makeRecord(
+                log.name, logging.ERROR, __file__, 10, 'Hi, %s!',
+                ('Gwenna',), sys.exc_info(), extra={ 'favorite': 'Olive' })
+        logging.Formatter('%(asctime)s %(message)s').format(record)
+        self.assertIn('asctime', record.__dict__)
+        fast = formatter.fast_format(record)
+        self.assertIsNotNone(fast)
+        expected = json.dumps(formatter.to_dict(record), cls=DjangoJSONEncoder)
+        self.assertEqual(fast, expected)
+
+
+class QueuePipelineTest(TestCase):
+    def test_pipeline(self):
+        logger = logging.getLogger('djenga_tests.queued')
+        logger.propagate = False
+        stream = StringIO()
+        handler = logging.StreamHandler(stream)
+        # a plain JsonFormatter, so the task fields in the output can
+        # only come from the records captured by the queue handler
+        handler.setFormatter(JsonFormatter())
+        logger.handlers = [ handler ]
+        pipeline = QueuePipeline(logger, batch_size=10, capture_task=True)
+        try:
+            with mock.patch('celery._state.get_current_task',
+                            return_value=JsonFormatterTest.MockTask()):
+                for x in range(25):
+                    logger.warning('minion %d', x)
+        finally:
+            pipeline.stop()
+            logger.handlers = []
+        lines = [ json.loads(x) for x in stream.getvalue().splitlines() ]
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(lines[-1]['message'], 'minion 24')
+        self.assertEqual(lines[-1]['task_id'], 'olive')
+        self.assertEqual(lines[-1]['task_name'], 'gwenna')
+
+    def test_setup_again(self):
+        logger = logging.getLogger('djenga_tests.queued_again')
+        logger.handlers = [ logging.StreamHandler(StringIO()) ]
+        setup = partial(
+            _queue_logger, capture_task=False, options={ 'batch_size': 10 })
+        try:
+            setup(logger=logger)
+            first = _pipelines[-1]
+            setup(logger=logger)
+            self.assertIs(_pipelines[-1], first)
+            self.assertEqual(len(logger.handlers), 1)
+            # e.g., celery hijacked the logger again
+            logger.handlers = [ logging.StreamHandler(StringIO()) ]
+            setup(logger=logger)
+            self.assertIsNone(first.listener)
+            self.assertNotIn(first, _pipelines)
+            self.assertIsInstance(logger.handlers[0], ContextQueueHandler)
+        finally:
+            for x in [ x for x in _pipelines if x.logger is logger ]:
+                x.stop()
+                _pipelines.remove(x)
+            logger.handlers = []
+
+    def test_bad_record(self):
+        stream = StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        records = [
+            log.makeRecord(
+                log.name, logging.INFO, __file__, 1, 'minion %d', (x,), None,
+                extra={ 'bad': object() } if x == 2 else None)
+            for x in range(5)
+        ]
+        with mock.patch.object(handler, 'handleError') as handle_error:
+            BatchingQueueListener.write_batch(handler, records)
+        handle_error.assert_called_once_with(records[2])
+        lines = [ json.loads(x) for x in stream.getvalue().splitlines() ]
+        self.assertEqual(
+            [ x['message'] for x in lines ],
+            [ 'minion 0', 'minion 1', 'minion 3', 'minion 4' ])
+
+    def test_drop_oldest(self):
+        handler = ContextQueueHandler(queue.Queue(2))
+        for x in range(5):
+            handler.emit(log.makeRecord(
+                log.name, logging.INFO, __file__, 1, 'minion %d', (x,), None))
+        self.assertEqual(handler.dropped, 3)
+        self.assertEqual(handler.queue.get_nowait().msg, 'minion 3')
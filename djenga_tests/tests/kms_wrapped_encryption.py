@@ -0,0 +1,55 @@
+from unittest import mock
+import uuid
+from django.test import TestCase
+from djenga.encryption import kms_wrapped
+
+
+__all__ = [ 'KmsWrappedTest', ]
+
+
+class MockKmsClient:
+    def __init__(self):
+        self.keys = {}
+
+    def generate_data_key(self, KeyId, KeySpec):  # noqa: N803
+        data_key = uuid.uuid4().bytes + uuid.uuid4().bytes
+        wrapped = uuid.uuid4().bytes
+        self.keys[wrapped] = data_key
+        return { 'Plaintext': data_key, 'CiphertextBlob': wrapped }
+
+    def decrypt(self, CiphertextBlob):  # noqa: N803
+        return { 'Plaintext': self.keys[CiphertextBlob] }
+
+
+class KmsWrappedTest(TestCase):
+    def setUp(self):
+        kms_wrapped.configure_data_key_cache(max_size=16, ttl=60)
+        self.client = MockKmsClient()
+        patcher = mock.patch(
+            'djenga.encryption.kms_wrapped._get_client',
+            return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_data_key_cache(self):
+        before = kms_wrapped.kms_cache_info()
+        value = kms_wrapped.encrypt('Hello, Stella!', 'olive')
+        kms_wrapped.configure_data_key_cache(max_size=16, ttl=60)
+        for _ in range(3):
+            self.assertEqual(kms_wrapped.decrypt(value), 'Hello, Stella!')
+        after = kms_wrapped.kms_cache_info()
+        self.assertEqual(
+            after['decrypt_calls'] - before['decrypt_calls'], 1)
+        self.assertEqual(after['decrypt_calls_avoided'], 2)
+
+    def test_reuse_data_key(self):
+        values = [
+            kms_wrapped.encrypt(f'value {x}', 'olive', reuse_data_key=True)
+            for x in range(5)
+        ]
+        self.assertEqual(len(self.client.keys), 1)
+        self.assertEqual(len({ x.split('|')[0] for x in values }), 1)
+        for i, x in enumerate(values):
+            self.assertEqual(kms_wrapped.decrypt(x), f'value {i}')
+        info = kms_wrapped.kms_cache_info()
+        self.assertGreaterEqual(info['generate_calls_avoided'], 4)
@@ -0,0 +1,132 @@
+import logging
+from unittest import mock
+from django.test import TestCase
+from djenga.loggers import BriefColorFormatter
+from djenga.loggers import ColorFormatter
+from djenga.loggers import RateLimitFilter
+from djenga.loggers import RuleFilter
+from djenga.loggers import SamplingFilter
+
+
+__all__ = [ 'ColorFormatterTest', 'RuleFilterTest', 'SuppressionFilterTest', ]
+log = logging.getLogger(__name__)
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class ColorFormatterTest(TestCase):
+    def record(self, **extra):
+        return log.makeRecord(
+            log.name, logging.WARNING, __file__, 1, 'Hello, %s!',
+            ('Gwenna',), None, extra=extra)
+
+    def test_extra(self):
+        formatted = ColorFormatter().format(
+            self.record(favorite='Olive', n_sheep=42))
+        self.assertTrue(formatted.startswith(
+            '\033[38;5;214m[WARNING/djenga_tests.tests.loggers]'
+            '\033[38;5;226m Hello, Gwenna!\n'))
+        self.assertIn("\n    favorite: 'Olive'", formatted)
+        self.assertIn('\n     n_sheep: 42', formatted)
+        self.assertTrue(formatted.endswith('\033[0m'))
+
+    def test_no_extra(self):
+        formatter = BriefColorFormatter('%(asctime)s %(message)s')
+        formatted = formatter.format(self.record())
+        self.assertTrue(formatted.startswith(
+            '\033[38;5;214m[WRN]\033[38;5;226m '))
+        self.assertTrue(formatted.endswith(' Hello, Gwenna!\033[0m'))
+
+
+class SuppressionFilterTest(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('djenga_tests.suppressed')
+        self.log.propagate = False
+        self.log.setLevel(logging.DEBUG)
+        self.handler = _ListHandler()
+        self.log.handlers = [ self.handler ]
+
+    def tearDown(self):
+        self.log.handlers = []
+        self.log.filters = []
+
+    def test_rate_limit(self):
+        self.log.addFilter(RateLimitFilter(rate=1, burst=3))
+        target = 'djenga.loggers.filters.monotonic'
+        with mock.patch(target, return_value=100.0):
+            for x in range(5):
+                self.log.warning('minion %d', x)
+            self.log.warning('banana')
+        with mock.patch(target, return_value=101.0):
+            self.log.warning('minion %d', 5)
+        messages = [ x.getMessage() for x in self.handler.records ]
+        self.assertEqual(messages, [
+            'minion 0', 'minion 1', 'minion 2', 'banana',
+            'suppressed 2 similar messages: minion %d', 'minion 5',
+        ])
+        self.assertEqual(self.handler.records[-2].suppressed, 2)
+
+    def test_sampling(self):
+        sampler = SamplingFilter(
+            rates={ 'DEBUG': 0.5 }, summary_interval=0, seed=42)
+        self.log.addFilter(sampler)
+        for x in range(100):
+            self.log.debug('minion %d', x)
+        self.log.info('banana')
+        records = self.handler.records
+        summaries = [ x for x in records if hasattr(x, 'suppressed') ]
+        passed = len(records) - len(summaries) - 1
+        self.assertTrue(20 < passed < 80)
+        self.assertEqual(
+            passed + sum(x.suppressed for x in summaries)
+            + sampler.counts[logging.DEBUG].suppressed, 100)
+        self.assertEqual(records[-1].getMessage(), 'banana')
+
+
+class RuleFilterTest(TestCase):
+    @staticmethod
+    def record(name, level, msg):
+        return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+    def test_default_rules(self):
+        f = RuleFilter()
+        self.assertFalse(f.filter(self.record(
+            'django.db.backends', logging.DEBUG, 'select 1')))
+        self.assertTrue(f.filter(self.record(
+            'django.db.backends', logging.INFO, 'select 1')))
+        self.assertFalse(f.filter(self.record(
+            'requests.packages', logging.INFO, 'connecting')))
+        self.assertFalse(f.filter(self.record(
+            'zeep.wsdl.bindings.soap', logging.WARNING,
+            'Forcing soap:address location to HTTPS')))
+        self.assertTrue(f.filter(self.record(
+            'zeep.wsdl.bindings.soap', logging.WARNING, 'something else')))
+        self.assertFalse(f.filter(self.record(
+            'celery.redirected', logging.WARNING,
+            'Restoring 3 unacknowledged message(s)')))
+        self.assertTrue(f.filter(self.record(
+            'myapp', logging.DEBUG, 'Hello, Gwenna!')))
+        self.assertIsNone(f.decisions['myapp'])
+
+    def test_custom_rules(self):
+        f = RuleFilter([
+            { 'prefix': 'myapp.noisy', 'levels': [ 'INFO' ] },
+            { 'prefix': 'myapp', 'message': lambda x: 'secret' in x.msg },
+        ])
+        self.assertFalse(f.filter(self.record(
+            'myapp.noisy', logging.INFO, 'hello')))
+        self.assertTrue(f.filter(self.record(
+            'myapp.noisy', logging.WARNING, 'hello')))
+        self.assertFalse(f.filter(self.record(
+            'myapp.quiet', logging.ERROR, 'the secret is out')))
+        self.assertTrue(f.filter(self.record(
+            'django', logging.DEBUG, 'the secret is out')))
+        with self.assertRaises(ValueError):
+            RuleFilter([ ('myapp', [ 'LOUD' ], None) ])
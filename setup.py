@@ -49,5 +49,6 @@ Useful building blocks for Django.""",
       entry_points={
           'console_scripts': [
               'kms_wrap=djenga.encryption.kms_wrap:main',
+              'kms_wrap_file=djenga.encryption.kms_wrap_file:main',
           ],
       })